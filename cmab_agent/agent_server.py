@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import lambda_function
+from model_store import LocalModelStore
+
+
+class AgentServer(object):
+    """
+    long running HTTP host for the CMAB agent.
+    every POST body is handled as the body of a Lambda event by lambda_function.lambda_handler, so the server accepts
+    the same requests as the Lambda agent and answers {"statusCode": 200, "body": <handler response>}, the shape the
+    API Gateway integration returns and CmabClient reads. All the models stay resident in lambda_function.model_cache
+    within the memory budget; evicted models and models with unsaved observations are written to the model store.
+
+    requests are handled one at a time on a single worker thread (the model cache is not thread safe), which keeps
+    model downloads and uploads from blocking the connections served by the event loop.
+    """
+
+    def __init__(self, host, port, flush_interval):
+        self.host = host
+        self.port = port
+        self.flush_interval = flush_interval
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.requests_served = 0
+
+    def handle(self, body):
+        try:
+            return 200, {"statusCode": 200, "body": lambda_function.lambda_handler({"body": body}, None)}
+        except lambda_function.UnsupportedAction as e:
+            return 400, {"statusCode": 400, "body": {"error": str(e)}}
+        except Exception as e:
+            return 500, {"statusCode": 500, "body": {"error": f"{type(e).__name__}: {e}"}}
+
+    async def serve_connection(self, reader, writer):
+        """
+        minimal HTTP/1.1: POST requests with a Content-Length body, connections kept alive until the client closes
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                headers = dict(line.split(':', 1) for line in header_lines if ':' in line)
+                headers = {name.strip().lower(): value.strip() for name, value in headers.items()}
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                if request_line.startswith('POST'):
+                    status, response = await loop.run_in_executor(self.executor, self.handle, body.decode())
+                    self.requests_served += 1
+                else:
+                    status, response = 405, {"error": "only POST is supported"}
+
+                payload = json.dumps(response).encode()
+                writer.write(
+                    f'HTTP/1.1 {status} {"OK" if status == 200 else "Error"}\r\n'
+                    f'Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n'.encode() + payload)
+                await writer.drain()
+
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    def flush_due(self, flush_all=False):
+        """
+        write the models whose checkpoint policy is due (every_seconds), or every model with unsaved observations.
+        a model that fails to be written is logged and skipped, the others are still written; a model kept in the cache
+        is tried again on the next call
+        """
+        for (bucket, key), cached in list(lambda_function.model_cache.items()):
+            checkpoint = cached['config'].get('checkpoint', {})
+            if (flush_all and cached['pending']) or lambda_function.checkpoint_due(cached, checkpoint):
+                try:
+                    lambda_function.upload_agent(bucket, key, cached['config'].get('max_retries', 5))
+                    print(f"AgentServer.flush_due - saved {bucket}/{key}")
+                except Exception as e:
+                    print(f"AgentServer.flush_due - could not save {bucket}/{key} ({cached['pending']} pending observations): {type(e).__name__}: {e}")
+
+    async def flush_periodically(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await loop.run_in_executor(self.executor, self.flush_due)
+            except Exception as e:
+                print(f"AgentServer.flush_periodically - {type(e).__name__}: {e}")
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for stop_signal in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(stop_signal, stop.set)
+
+        server = await asyncio.start_server(self.serve_connection, self.host, self.port)
+        flusher = asyncio.create_task(self.flush_periodically())
+        print(f"AgentServer.run - listening on {self.host}:{self.port}")
+
+        async with server:
+            await stop.wait()
+
+        flusher.cancel()
+        print(f"AgentServer.run - stopping after {self.requests_served} requests, saving unsaved models...")
+        await loop.run_in_executor(self.executor, self.flush_due, True)
+        self.executor.shutdown()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Run the CMAB agent as a long running multi-model HTTP server.')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--memory-budget', type=int, default=512, help='MB of models kept in memory, least recently used models are evicted beyond it')
+    parser.add_argument('--cache-ttl', type=float, default=3600, help='Seconds a resident model is used without checking its version in the store')
+    parser.add_argument('--flush-interval', type=float, default=5, help='Seconds between checks of the time based checkpoint policies')
+    parser.add_argument('--store-dir', help='Persist models to this local directory instead of S3')
+    parser.add_argument('--model-path', help='Local working directory for model files, a temporary directory by default')
+    parser.add_argument('--verbose', action='store_true', help='Log every received event')
+
+    args = parser.parse_args()
+
+    lambda_function.cache_budget = args.memory_budget * 1024 * 1024
+    lambda_function.cache_ttl = args.cache_ttl
+    lambda_function.verbose = args.verbose
+    lambda_function.local_model_path = args.model_path or tempfile.mkdtemp()
+    if args.store_dir:
+        lambda_function.model_store = LocalModelStore(args.store_dir)
+    os.makedirs(lambda_function.local_model_path, exist_ok=True)
+
+    asyncio.run(AgentServer(args.host, args.port, args.flush_interval).run())
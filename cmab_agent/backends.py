@@ -0,0 +1,13 @@
+from importlib import import_module
+
+# backend name -> (module, class). The modules are only imported when a backend is first used, so that an agent only
+# pays the import of the library (vowpalwabbit or numpy) it actually runs on.
+backends = {
+    "vw": ("vw_backend", "VWBackend"),
+    "numpy": ("numpy_backend", "NumpyBackend"),
+}
+
+
+def get_backend(name):
+    module_name, class_name = backends[name]
+    return getattr(import_module(module_name), class_name)
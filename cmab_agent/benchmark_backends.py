@@ -0,0 +1,94 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from lambda_function import optimizer
+
+memory_list = [128, 256, 512, 1024, 2048]
+
+backend_configs = {
+    "vw": ("vw", None),
+    "numpy_epsilon_greedy": ("numpy", {"algorithm": "epsilon_greedy"}),
+    "numpy_linucb": ("numpy", {"algorithm": "linucb"}),
+    "numpy_thompson": ("numpy", {"algorithm": "thompson"}),
+}
+
+
+def load_records(path):
+    """
+    read logged payloads, one JSON object per line, as stored in logs_processor_data.payload:
+    {"memory_size": "128", "billed_duration": "339", "payload_size": "11", ...}
+    the logs carry no action probability, observations are replayed as if the memory was picked uniformly.
+    """
+    requests = []
+    with open(path) as records_file:
+        for line in records_file:
+            payload = json.loads(line)
+            requests.append({
+                "memory": int(payload["memory_size"]),
+                "cost": float(payload["billed_duration"]),
+                "probability": 1 / len(memory_list),
+                "bytes": int(payload["payload_size"]),
+            })
+    return requests
+
+
+def synthetic_records(n):
+    requests = []
+    for _ in range(n):
+        memory = random.choice(memory_list)
+        payload_size = random.randint(1, 100)
+        requests.append({
+            "memory": memory,
+            "cost": payload_size * 1000 / memory + random.random(),
+            "probability": 1 / len(memory_list),
+            "bytes": payload_size,
+        })
+    return requests
+
+
+def benchmark(name, backend, backend_params, requests, model_path):
+    agent = optimizer(
+        memory_list=memory_list,
+        optimization_objective="time",
+        features=["bytes"],
+        model_name=f"benchmark_{name}",
+        model_path=model_path,
+        backend=backend,
+        backend_params=backend_params)
+
+    start = time.perf_counter()
+    agent.observe_batch(requests)
+    learn_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    recommendations = [agent.recommend(request)[0] for request in requests]
+    predict_time = time.perf_counter() - start
+
+    agent.save_model_state()
+    model_size = os.path.getsize(os.path.join(model_path, f"benchmark_{name}.model"))
+
+    most_recommended = max(set(recommendations), key=recommendations.count)
+    print(f"{name:<22} learn: {learn_time:8.3f}s  predict: {predict_time:8.3f}s  "
+          f"model size: {model_size:>8} bytes  most recommended memory: {most_recommended}")
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the CMAB agent backends on logged (or synthetic) observations.')
+    parser.add_argument('--records', help='JSON lines file of logged payloads, synthetic observations are used if not given')
+    parser.add_argument('--n', type=int, default=10000, help='Number of synthetic observations')
+    parser.add_argument('--backends', nargs='+', default=list(backend_configs), choices=list(backend_configs))
+
+    args = parser.parse_args()
+
+    requests = load_records(args.records) if args.records else synthetic_records(args.n)
+    print(f"benchmarking {len(requests)} observations")
+
+    with tempfile.TemporaryDirectory() as model_path:
+        for name in args.backends:
+            backend, backend_params = backend_configs[name]
+            benchmark(name, backend, backend_params, requests, model_path)
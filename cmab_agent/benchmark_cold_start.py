@@ -0,0 +1,67 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# runs in a fresh interpreter, so that every measurement pays the imports like a Lambda cold start does
+cold_start_snippet = '''
+import json
+import sys
+import time
+
+start = time.perf_counter()
+import lambda_function
+imported = time.perf_counter()
+
+agent = lambda_function.optimizer(
+    memory_list=[128, 256, 512, 1024, 2048],
+    optimization_objective="time",
+    features=["bytes"],
+    model_name="cold_start",
+    model_path=sys.argv[2],
+    backend=sys.argv[1])
+agent.recommend({"bytes": 1})
+first_request = time.perf_counter()
+
+print(json.dumps({"import": imported - start, "first_request": first_request - imported}))
+'''
+
+
+def measure(backend, model_path):
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, '-c', cold_start_snippet, backend, model_path],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout
+    total = time.perf_counter() - start
+
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings["total"] = total
+    return timings
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Measure the CMAB agent cold start: module import and first recommendation, each run in a fresh interpreter.')
+    parser.add_argument('--backend', default='vw', choices=['vw', 'numpy'])
+    parser.add_argument('--runs', type=int, default=5, help='Number of cold starts to measure')
+    parser.add_argument('--max-seconds', type=float, help='Fail (exit code 1) when the median import + first request time is above this')
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as model_path:
+        runs = [measure(args.backend, model_path) for _ in range(args.runs)]
+
+    medians = {name: statistics.median(run[name] for run in runs) for name in ("import", "first_request", "total")}
+    print(f"backend: {args.backend}, runs: {args.runs}")
+    print(f"median import:          {medians['import'] * 1000:8.1f} ms")
+    print(f"median first request:   {medians['first_request'] * 1000:8.1f} ms")
+    print(f"median process total:   {medians['total'] * 1000:8.1f} ms")
+
+    cold_start = medians['import'] + medians['first_request']
+    if args.max_seconds is not None and cold_start > args.max_seconds:
+        print(f"cold start regression: {cold_start:.3f}s > {args.max_seconds}s")
+        sys.exit(1)
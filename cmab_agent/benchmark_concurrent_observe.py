@@ -0,0 +1,102 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+bucket = "dfaastest-cmab-agent"
+model_name = "concurrent_observe"
+memory_list = [128, 256, 512, 1024, 2048]
+
+
+def make_event(action, model_config, request=None):
+    event = {
+        "Event": {
+            "S3": {"bucket": bucket, "key": f"{model_name}.model"},
+            "action": action,
+            "Request": request,
+            "Keys": {"feature_keys": ["bytes"], "mem_key": "memory", "cost_key": "cost", "prob_key": "probability"},
+            "config": model_config,
+        }
+    }
+    return {"body": json.dumps(event)}
+
+
+def start_instance(store_dir):
+    """
+    every pool process plays one agent instance: its own module level model cache and its own local disk
+    """
+    os.environ['CMAB_MODEL_STORE_DIR'] = store_dir
+
+    import lambda_function
+    lambda_function.local_model_path = tempfile.mkdtemp()
+    sys.stdout = open(os.devnull, 'w')  # the handler logs every event
+
+
+def send_observes(args):
+    n_observes, model_config = args
+
+    import lambda_function
+    for _ in range(n_observes):
+        request = {
+            "memory": random.choice(memory_list),
+            "cost": random.random(),
+            "probability": 1 / len(memory_list),
+            "bytes": random.randint(1, 100),
+        }
+        lambda_function.lambda_handler(make_event("observe", model_config, request), None)
+
+    lambda_function.lambda_handler(make_event("flush", model_config), None)
+    return lambda_function.cache_stats["conflicts"]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Fan observe requests out over concurrent agent instances sharing a local model store, and check that no observation is lost.')
+    parser.add_argument('--instances', type=int, default=4)
+    parser.add_argument('--observes', type=int, default=100, help='Number of observe requests per instance')
+    parser.add_argument('--every-n', type=int, default=1, help='Checkpoint policy of the agents, see documentation.txt')
+
+    args = parser.parse_args()
+
+    # the numpy backend counts the observations per arm, which lets us check that every observation made it in
+    model_config = {
+        "memory_list": memory_list,
+        "objective": "time",
+        "features": ["bytes"],
+        "model_name": model_name,
+        "backend": "numpy",
+        "checkpoint": {"every_n": args.every_n},
+        "max_retries": 1000,
+    }
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        from lambda_function import optimizer
+        from model_store import LocalModelStore
+
+        # seed the store with an empty model, the agent expects one to exist
+        seed_path = tempfile.mkdtemp()
+        agent = optimizer(memory_list, "time", ["bytes"], model_name, seed_path, backend="numpy")
+        agent.save_model_state()
+        store = LocalModelStore(store_dir)
+        with open(os.path.join(seed_path, f"{model_name}.model"), 'rb') as model_file:
+            store.put(bucket, f"{model_name}.model", model_file.read())
+
+        start = time.perf_counter()
+        with multiprocessing.get_context('spawn').Pool(args.instances, start_instance, (store_dir,)) as pool:
+            conflicts = pool.map(send_observes, [(args.observes, model_config)] * args.instances)
+        elapsed = time.perf_counter() - start
+
+        data, _ = store.get(bucket, f"{model_name}.model")
+        with open(os.path.join(seed_path, f"{model_name}.model"), 'wb') as model_file:
+            model_file.write(data)
+        agent.load_model()
+
+    expected = args.instances * args.observes
+    learned = int(agent.model.counts.sum())
+    print(f"{args.instances} instances x {args.observes} observes in {elapsed:.2f}s "
+          f"({expected / elapsed:.0f} observes/s), {sum(conflicts)} write conflicts merged")
+    print(f"observations learned: {learned} / {expected} {'OK' if learned == expected else 'LOST UPDATES'}")
@@ -0,0 +1,63 @@
+import argparse
+import random
+import timeit
+
+from vw_format import VWExampleBuilder
+
+memory_list = [128, 256, 512, 1024, 2048]
+mem2action = {memory_list[i]: i+1 for i in range(len(memory_list))}
+
+
+def concatenated_vw_format(request, feature_keys, predict_mode=False, mem_key=None, cost_key=None, prob_key=None):
+    """
+    the previous optimizer.convert_to_vw_format, kept as the baseline
+    """
+    if not predict_mode:
+        obs = (
+        str(mem2action[request[mem_key]])
+        + ":"
+        + str(request[cost_key])
+        + ":"
+        + str(request[prob_key])
+        + " |"
+    )
+    else:
+        obs = "|"
+
+    for key in feature_keys:
+        obs += " " + str(request[key])
+
+    return obs
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compare building vw examples by string concatenation and with the compiled VWExampleBuilder.')
+    parser.add_argument('--n', type=int, default=10000, help='Number of requests per batch')
+    parser.add_argument('--features', type=int, default=1, help='Number of features per request')
+    parser.add_argument('--repeat', type=int, default=20)
+
+    args = parser.parse_args()
+
+    feature_keys = ["bytes"] + [f"feature_{i}" for i in range(1, args.features)]
+    requests = [{"memory": random.choice(memory_list), "cost": random.random() * 500, "probability": random.random(),
+                 **{key: random.randint(1, 100) for key in feature_keys}} for _ in range(args.n)]
+    keys = ("memory", "cost", "probability")
+
+    builder = VWExampleBuilder(mem2action)
+    assert builder.build_batch(requests, feature_keys, False, *keys) == \
+        [concatenated_vw_format(request, feature_keys, False, *keys) for request in requests]
+    assert builder.build_batch(requests, feature_keys, True) == \
+        [concatenated_vw_format(request, feature_keys, True) for request in requests]
+
+    cases = {
+        "concatenation": lambda: [concatenated_vw_format(request, feature_keys, False, *keys) for request in requests],
+        "builder": lambda: [builder.build(request, feature_keys, False, *keys) for request in requests],
+        "builder batch": lambda: builder.build_batch(requests, feature_keys, False, *keys),
+    }
+
+    baseline = None
+    for name, case in cases.items():
+        seconds = min(timeit.repeat(case, number=1, repeat=args.repeat))
+        baseline = baseline or seconds
+        print(f"{name:<14} {seconds / args.n * 1e9:8.0f} ns/example  ({baseline / seconds:.2f}x)")
@@ -1,15 +1,58 @@
 import json
 import urllib.parse
-import vowpalwabbit as vw
-import boto3
 import random
 import os
+from bisect import bisect_right
+from itertools import accumulate
 import pickle
+import time
+from collections import OrderedDict
+
+from backends import get_backend
+from model_store import LocalModelStore, S3ModelStore, VersionConflict
+from vw_format import VWExampleBuilder
 
 print('Loading function')
 
-#s3 = boto3.client('s3')
-s3 = boto3.resource('s3')
+# where models are written to and loaded from on the instance's disk
+local_model_path = "/tmp"
+
+# The model store is created on first use rather than at import, so that boto3 and the S3 client are not paid before
+# the handler starts. Setting CMAB_MODEL_STORE_DIR swaps S3 for a local directory (see model_store.LocalModelStore).
+model_store = None
+
+
+def get_store():
+    global model_store
+    if model_store is None:
+        if os.environ.get('CMAB_MODEL_STORE_DIR'):
+            model_store = LocalModelStore(os.environ['CMAB_MODEL_STORE_DIR'])
+        else:
+            model_store = S3ModelStore()
+    return model_store
+
+# Loaded agents are kept at module level so that warm invocations of the same container can reuse them.
+# Keyed by (bucket, key); each entry holds the agent, the version (ETag) of the model it was loaded from
+# and the config it was built with, plus the write-behind state: the observations learned since the
+# last checkpoint to S3 and when that checkpoint happened, and when the version was last checked against S3.
+# Entries are kept in least recently used order and record the size of their model file.
+model_cache = OrderedDict()
+cache_stats = {"hits": 0, "misses": 0, "conflicts": 0, "evictions": 0}
+
+# limit on the total size (bytes) of the cached models, the least recently used ones are evicted beyond it. None means
+# no limit, which is fine for a Lambda serving one model but not for a host serving many (see agent_server.py).
+cache_budget = None
+
+# seconds a cached model is used for any action without checking its version in S3. 0 for Lambda, where instances come
+# and go; a long running host that owns its models can trust its cache (conflicting writes are still caught on upload).
+cache_ttl = 0
+
+# log every received event
+verbose = True
+
+# the actions of the requests' Event
+actions = ('recommend', 'observe', 'observe_batch', 'flush')
+
 
 class optimizer():
     def __init__(self,
@@ -17,17 +60,23 @@ class optimizer():
                  optimization_objective: str,
                  features: list,
                  model_name: str,
-                 model_path: str
+                 model_path: str,
+                 backend: str = "vw",
+                 backend_params: dict = None,
+                 seed: int = None
                 ):
         """
-        this optimizer supports sequential learning (batched learning not supported).
-        observations will be fed in one after another to update the model.s
+        this optimizer supports sequential learning, observations are fed in one after another to update the model.
+        batches of observations (observe_batch) are learned in order.
         ------
         memory_list: a sorted list of candidate memory sizes, in ascending order
         optimization_objective: "budget", or "time".
         --TODO: consider supporting weighted sum of different objectives in future
         features: list of the contextual features that the optimizer will take into account when learning
         model_path: the place where the model is stored at and can be loaded from
+        backend: "vw" (vowpalwabbit --cb_explore) or "numpy" (see numpy_backend.NumpyBackend)
+        backend_params: hyperparameters of the backend, e.g. {"epsilon": 0.1} or {"algorithm": "linucb", "alpha": 1.0}
+        seed: seed of the random generator used to sample the recommended memory, for reproducible experiments
         """
         self.memories = memory_list # TODO: transform candidates into integers from 1 to N
         self.mem2action = {self.memories[i]: i+1 for i in range(len(self.memories))}
@@ -39,11 +88,13 @@ class optimizer():
         self.model_name = model_name
         self.model_path = model_path
 
-#         if os.path.exists(os.path.join(self.model_path, self.model_name)):
-#             self.model = vw
-#         else:
-        self.model = vw.Workspace(f"--cb_explore {self.n_actions} --power_t 1 --decay_learning_rate 1 --epsilon 0.1", quiet=True, enable_logging=True)
-            # TODO: add other hyperparameters here
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.np_rng = None  # numpy generator for batch sampling, created on first use
+
+        self.vw_builder = VWExampleBuilder(self.mem2action)
+        self.backend = backend
+        self.model = get_backend(backend)(self.n_actions, len(self.features), backend_params)
 
 
     def convert_to_vw_format(self,
@@ -62,22 +113,55 @@ class optimizer():
             - probability: the probability that this action was chosen
             - features: other features of this request
         """
-        if not predict_mode:
-            obs = (
-            str(self.mem2action[request[mem_key]])
-            + ":"
-            + str(request[cost_key])
-            + ":"
-            + str(request[prob_key])
-            + " |"
-        )
-        else:
-            obs = "|"
+        return self.vw_builder.build(request, feature_keys, predict_mode, mem_key, cost_key, prob_key)
 
-        for key in feature_keys:
-            obs += " " + str(request[key])
-        
-        return obs
+    def convert_to_vw_format_batch(self,
+                                   requests: list,
+                                   feature_keys: list,
+                                   predict_mode = False,
+                                   mem_key: str = None,
+                                   cost_key:str = None,
+                                   prob_key: str = None):
+        """
+        Convert a list of input requests to vw-compatible format, see convert_to_vw_format
+        """
+        return self.vw_builder.build_batch(requests, feature_keys, predict_mode, mem_key, cost_key, prob_key)
+
+    def convert_to_arrays(self,
+                          requests: list,
+                          feature_keys: list,
+                          predict_mode = False,
+                          mem_key: str = None,
+                          cost_key:str = None,
+                          prob_key: str = None):
+        """
+        Convert a list of input requests to the (features, actions, costs, probabilities) arrays of the numpy backend.
+        actions, costs and probabilities are None in predict mode.
+        """
+        import numpy as np
+
+        features = np.array([[request[key] for key in feature_keys] for request in requests], dtype=np.float64)
+        if predict_mode:
+            return features, None, None, None
+
+        actions = np.array([self.mem2action[request[mem_key]] for request in requests])
+        costs = np.array([request[cost_key] for request in requests], dtype=np.float64)
+        probabilities = np.array([request[prob_key] for request in requests], dtype=np.float64)
+        return features, actions, costs, probabilities
+
+    def encode(self,
+               requests: list,
+               feature_keys: list,
+               predict_mode = False,
+               mem_key: str = None,
+               cost_key:str = None,
+               prob_key: str = None):
+        """
+        Convert a list of input requests to the examples expected by the backend
+        """
+        if self.model.input_format == "vw":
+            return self.convert_to_vw_format_batch(requests, feature_keys, predict_mode, mem_key, cost_key, prob_key)
+        return self.convert_to_arrays(requests, feature_keys, predict_mode, mem_key, cost_key, prob_key)
 
     def observe(self,
                 request,
@@ -89,82 +173,277 @@ class optimizer():
         given a trial which has an action, cost, probability of the action, and features,
         learn the data and update the model
         """
-        self.model.learn(self.convert_to_vw_format(request, feature_keys, False, mem_key, cost_key, prob_key))
+        self.model.learn_batch(self.encode([request], feature_keys, False, mem_key, cost_key, prob_key))
+
+    def observe_batch(self,
+                      requests: list,
+                      feature_keys: list = ["bytes"],
+                      mem_key: str = "memory",
+                      cost_key:str = "cost",
+                      prob_key: str = "probability"):
+        """
+        learn a list of trials, in order, in a single pass over the loaded model.
+        the examples are all converted before learning starts, so a malformed trial leaves the model untouched.
+        """
+        self.model.learn_batch(self.encode(requests, feature_keys, False, mem_key, cost_key, prob_key))
 
     @staticmethod
-    def sample_custom_pmf(pmf):
-        total = sum(pmf)
-        scale = 1 / total
-        pmf = [x * scale for x in pmf]
-        draw = random.random()
-        sum_prob = 0.0
-        for index, prob in enumerate(pmf):
-            sum_prob += prob
-            if sum_prob > draw:
-                return index, prob
+    def sample_custom_pmf(pmf, rng=random):
+        """
+        draw an index from the (unnormalized) pmf with a binary search over its cumulative sum.
+        returns the index and its normalized probability.
+        """
+        cumulative = list(accumulate(pmf))
+        total = cumulative[-1]
+        # min() guards against a draw falling past the last bucket through floating point rounding
+        index = min(bisect_right(cumulative, rng.random() * total), len(cumulative) - 1)
+        return index, pmf[index] / total
+
+    def sample_pmf_batch(self, pmfs):
+        """
+        draw one index per row of the (n, K) pmfs in a single vectorized pass.
+        returns the indexes and the (n, K) normalized pmfs.
+        """
+        import numpy as np
+
+        if self.np_rng is None:
+            self.np_rng = np.random.default_rng(self.seed)
+
+        pmfs = np.asarray(pmfs, dtype=np.float64)
+        pmfs = pmfs / pmfs.sum(axis=1, keepdims=True)
+        cumulative = np.cumsum(pmfs, axis=1)
+        draws = self.np_rng.random(len(pmfs))[:, None]
+        indexes = np.minimum((cumulative <= draws).sum(axis=1), self.n_actions - 1)
+        return indexes, pmfs
 
     def recommend(self,
                   request,
                   feature_keys: list = ["bytes"]):
         """
-        given an incoming trail with certain features, recommend an memory
+        given an incoming trail with certain features, recommend an memory.
+        returns the memory, its probability and the probability of every memory in memory_list order.
         """
-        rec_probabilities = self.model.predict(self.convert_to_vw_format(request, feature_keys, True))
+        rec_probabilities = [float(prob) for prob in self.model.predict_batch(self.encode([request], feature_keys, True))[0]]
+
+        index, prob = self.sample_custom_pmf(rec_probabilities, self.rng)
+        total = sum(rec_probabilities)
+        return (self.action2mem[index+1], prob, [prob / total for prob in rec_probabilities])
+
+    def recommend_batch(self,
+                        requests: list,
+                        feature_keys: list = ["bytes"]):
+        """
+        recommend a memory for each of a list of trails, predicting and sampling the whole batch at once.
+        returns a list of (memory, probability, probability list) as recommend does.
+        """
+        indexes, pmfs = self.sample_pmf_batch(self.model.predict_batch(self.encode(requests, feature_keys, True)))
+        return [(self.memories[index], float(pmf[index]), pmf.tolist()) for index, pmf in zip(indexes, pmfs)]
 
-        index, prob = self.sample_custom_pmf(rec_probabilities)
-        return (self.action2mem[index+1], prob)
-    
     def save_model_state(self):
         """
         save the current model for future use
         """
         self.model.save(f"{os.path.join(self.model_path, self.model_name)}.model")
+
     def load_model(self):
         """
         load and continue to use current model.
         """
-        self.model = vw.Workspace(f"-i {os.path.join(self.model_path, self.model_name)}.model",
-                                 enable_logging=True)
+        self.model.load(f"{os.path.join(self.model_path, self.model_name)}.model")
         print("successfully load the model into the agent instance.")
 
 
+def new_agent(model_config):
+    """
+    an agent with an untrained model, built from the config sent with the requests
+    """
+    return optimizer(
+            memory_list=model_config['memory_list'],
+            optimization_objective=model_config['objective'],
+            features=model_config['features'],
+            model_name=model_config['model_name'],
+            model_path=local_model_path,
+            backend=model_config.get('backend', 'vw'),
+            backend_params=model_config.get('backend_params'),
+            seed=model_config.get('seed'))
+
+
+def load_agent(bucket, key, model_config):
+    """
+    download the latest model stored at bucket/key and load it into a new agent.
+    returns the agent, the version and the size of the model.
+    """
+    agent = new_agent(model_config)
+
+    # a single GET returns both the model and its version, no HEAD needed
+    data, version = get_store().get(bucket, key)
+    with open(os.path.join(local_model_path, key), 'wb') as model_file:
+        model_file.write(data)
+    print("Found existing model. Successfully downloaded file.")
+    agent.load_model()
+    print("Loaded the existing model file into the agent.")
+
+    return agent, version, len(data)
+
+
+def get_agent(bucket, key, model_config, max_staleness=0):
+    """
+    return an agent for the model stored at bucket/key.
+    the cached agent is reused as long as the S3 object was not rewritten by another instance, otherwise the model is
+    downloaded and loaded again.
+    max_staleness: number of seconds a cached agent can be used without checking its version against S3.
+    """
+    cached = model_cache.get((bucket, key))
+    if cached:
+        model_cache.move_to_end((bucket, key))
+
+    # a model with unsaved observations is the most recent state we know of, keep using it until it is flushed
+    if cached and cached['pending'] and cached['config'] == model_config:
+        cache_stats['hits'] += 1
+        print(f"model cache hit for {bucket}/{key} ({cached['pending']} observations pending checkpoint).")
+        return cached['agent'], True
+
+    if cached and cached['config'] == model_config:
+        if time.time() - cached['validated'] < max_staleness:
+            cache_stats['hits'] += 1
+            print(f"model cache hit for {bucket}/{key} (validated {time.time() - cached['validated']:.1f}s ago).")
+            return cached['agent'], True
+
+        version = get_store().head(bucket, key)
+        if cached['version'] == version:
+            cached['validated'] = time.time()
+            cache_stats['hits'] += 1
+            print(f"model cache hit for {bucket}/{key} (version {version}).")
+            return cached['agent'], True
+
+    if cached and cached['pending']:
+        # the config changed: save the observations learned with the previous one before the model is loaded again
+        print(f"model config changed for {bucket}/{key}, saving {cached['pending']} pending observations first.")
+        upload_agent(bucket, key, cached['config'].get('max_retries', 5))
+
+    cache_stats['misses'] += 1
+    print(f"model cache miss for {bucket}/{key}.")
+
+    agent, version, size = load_agent(bucket, key, model_config)
+    model_cache[(bucket, key)] = {'agent': agent, 'version': version, 'config': model_config, 'size': size,
+                                  'pending': 0, 'unsaved': [],
+                                  'last_checkpoint': time.time(), 'validated': time.time()}
+    model_cache.move_to_end((bucket, key))
+    return agent, False
+
+
+def upload_agent(bucket, key, max_retries=5):
+    """
+    save the cached agent's model state to S3, on the condition that nobody wrote the model since we loaded it.
+    if another instance did, its model is loaded and the observations we have not saved yet are learned again on top
+    of it, then the write is retried. Once written, the new version is recorded in the cache so that our own write does
+    not invalidate the cached agent on the next invocation. returns the agent, which is a new one after a conflict.
+    """
+    cached = model_cache[(bucket, key)]
+
+    for attempt in range(max_retries + 1):
+        cached['agent'].save_model_state()
+        with open(os.path.join(local_model_path, key), 'rb') as model_file:
+            data = model_file.read()
+
+        try:
+            cached['version'] = get_store().put(bucket, key, data, if_match=cached['version'])
+            cached['size'] = len(data)
+            break
+        except VersionConflict as e:
+            cache_stats['conflicts'] += 1
+            if attempt == max_retries:
+                # drop the agent so the next call starts from the latest model, the unsaved observations are lost
+                model_cache.pop((bucket, key), None)
+                raise e
+
+            print(f"{e}, merging {cached['pending']} unsaved observations into the latest model (attempt {attempt + 1}).")
+            cached['agent'], cached['version'], cached['size'] = load_agent(bucket, key, cached['config'])
+            for requests, keys in cached['unsaved']:
+                cached['agent'].observe_batch(
+                    requests, keys['feature_keys'], keys['mem_key'], keys['cost_key'], keys['prob_key'])
+
+    cached['pending'] = 0
+    cached['unsaved'] = []
+    cached['last_checkpoint'] = time.time()
+    cached['validated'] = time.time()
+    return cached['agent']
+
+
+def evict_models():
+    """
+    drop least recently used models until the cache fits in cache_budget, saving their unsaved observations first.
+    the most recently used model is always kept. A model whose observations can not be saved stays cached (the error
+    is logged, not raised: the request that triggered the eviction already succeeded), it is tried again on the next
+    eviction or checkpoint.
+    """
+    if cache_budget is None:
+        return
+
+    for (bucket, key), cached in list(model_cache.items())[:-1]:
+        if sum(entry['size'] for entry in model_cache.values()) <= cache_budget:
+            break
+        if cached['pending']:
+            try:
+                upload_agent(bucket, key, cached['config'].get('max_retries', 5))
+            except Exception as e:
+                print(f"could not evict model {bucket}/{key}, saving its {cached['pending']} pending observations failed: {type(e).__name__}: {e}")
+                continue
+        model_cache.pop((bucket, key))
+        cache_stats['evictions'] += 1
+        print(f"evicted model {bucket}/{key} from the cache.")
+
+
+def checkpoint_due(cached, checkpoint):
+    """
+    decide whether the model should be written back to S3 given the experiment's checkpoint policy:
+    - every_n: persist once this many observations are pending (1 = after every observe, the default)
+    - every_seconds: persist once this many seconds passed since the last checkpoint
+    when both are 0 the model is only persisted by an explicit "flush" action.
+    """
+    every_n = checkpoint.get('every_n', 1)
+    every_seconds = checkpoint.get('every_seconds', 0)
+
+    if not cached['pending']:
+        return False
+    if every_n and cached['pending'] >= every_n:
+        return True
+    if every_seconds and time.time() - cached['last_checkpoint'] >= every_seconds:
+        return True
+    return False
+
+
+class UnsupportedAction(ValueError):
+    """
+    the request's action is not one the agent handles, a client error (400) rather than a failure of the agent
+    """
+
+
 def lambda_handler(event, context):
-    print("Received event: " + json.dumps(event, indent=2))
+    if verbose:
+        print("Received event: " + json.dumps(event, indent=2))
     
     body = json.loads(event['body'])
     
     action = body['Event']['action']
+    if action not in actions:
+        raise UnsupportedAction(f"unsupported action {action!r}, expected one of {', '.join(actions)}")
     bucket = body['Event']['S3']['bucket']
     key = body['Event']['S3']['key']
     model_config = body['Event']['config']
     
     
-    ## step 1: get the model from S3 or create a new model if nothing exists in S3
-    
+    ## step 1: get the model from the warm container cache, or from S3 if it changed since it was loaded
+
     #todo: support configing these? maybe store these parameters as a dictionary to S3, so we don't need them
     # to be sent with request every time.
-#     agent = optimizer(
-#                 memory_list=[64, 128],
-#                 optimization_objective="time",
-#                 features=["bytes"],
-#                 model_name="example",  
-#                 model_path="/tmp")
-    agent = optimizer(
-            memory_list=model_config['memory_list'],
-            optimization_objective=model_config['objective'],
-            features=model_config['features'],
-            model_name=model_config['model_name'],
-            model_path="/tmp")
-
     try:
-        s3.meta.client.download_file(bucket, key, f'/tmp/{key}')
-        
-        print("Found existing model. Successfully downloaded file.")
-        agent.load_model()
-        print("Loaded the existing model file into the agent.")
+        # recommend does not change the model, it may use a cached model that was validated recently
+        max_staleness = max(cache_ttl, model_config.get('recommend_staleness', 0) if action == "recommend" else 0)
+        agent, cache_hit = get_agent(bucket, key, model_config, max_staleness)
     except Exception as e:
         print(e)
-        print('Error getting object {} from bucket {}. Use a new agent'.format(key, bucket))
+        print('Error getting object {} from bucket {}.'.format(key, bucket))
         raise e   
         
     
@@ -172,10 +451,11 @@ def lambda_handler(event, context):
     if action=="recommend":
         request = body['Event']['Request']
         keys = body['Event']['Keys']
-        rec_action, prob = agent.recommend(request, keys['feature_keys'])
+        rec_action, prob, probability_list = agent.recommend(request, keys['feature_keys'])
         response = {"result": {
             "recommended_memory": rec_action,
-            "action_probability": prob
+            "action_probability": prob,
+            "probability_list": probability_list
         }}
     elif action=="observe":
         request = body['Event']['Request']
@@ -189,16 +469,45 @@ def lambda_handler(event, context):
         except Exception as e:
             print(request)
             print("cannot learn the request. check request input.")
+            # the backends encode the whole request before learning it, the model was not changed: the cached agent and
+            # its pending observations are kept
             raise e
         response = {"result": 1}
-        ## optional step 3: upload the new model state to S3 -> we only need this for observe() event since recommend()
-        # does not update the state of the model.
-        agent.save_model_state()
-        s3.meta.client.upload_file(f'/tmp/{key}', bucket, key)
+    elif action=="observe_batch":
+        requests = body['Event']['Requests']
+        keys = body['Event']['Keys']
+        try:
+            agent.observe_batch(requests, keys['feature_keys'], keys['mem_key'], keys['cost_key'], keys['prob_key'])
+        except Exception as e:
+            print(requests)
+            print("cannot learn the batch of requests. check request input.")
+            raise e
+        response = {"result": len(requests)}
+    elif action=="flush":
+        response = {"result": model_cache[(bucket, key)]['pending']}
+
+    ## optional step 3: upload the new model state to S3 -> we only need this for observe() event since recommend()
+    # does not update the state of the model. Depending on the checkpoint policy the upload is deferred.
+    # the observations are kept until they are saved, to be learned again if another instance wrote the model meanwhile
+    cached = model_cache[(bucket, key)]
+    if action=="observe":
+        cached['pending'] += 1
+        cached['unsaved'].append(([request], keys))
+    elif action=="observe_batch":
+        cached['pending'] += len(requests)
+        cached['unsaved'].append((requests, keys))
+
+    checkpoint = model_config.get('checkpoint', {})
+    saved = False
+    if (action=="flush" and cached['pending']) or checkpoint_due(cached, checkpoint):
+        upload_agent(bucket, key, model_config.get('max_retries', 5))
+        saved = True
         print("successfully updated the model state to S3.")
-    return response
-    
 
+    response["checkpoint"] = {"saved": saved, "pending": cached['pending']}
 
+    response["cache"] = {"hit": cache_hit, **cache_stats}
 
-        
\ No newline at end of file
+    evict_models()
+    return response
+    
@@ -0,0 +1,95 @@
+import fcntl
+import hashlib
+import os
+
+
+class VersionConflict(Exception):
+    """
+    raised by a conditional put when the stored object is no longer the version the writer last read
+    """
+
+
+class S3ModelStore(object):
+    """
+    model objects in S3. The version of an object is its ETag, which conditional puts check with S3's If-Match
+    precondition (boto3/botocore 1.35.68 or later, shipped in the deployment package).
+    """
+
+    def __init__(self):
+        # boto3 is only imported when the store is first used, see lambda_function.get_store
+        import boto3
+        self.client = boto3.client('s3')
+
+    def head(self, bucket, key):
+        return self.client.head_object(Bucket=bucket, Key=key)['ETag']
+
+    def get(self, bucket, key):
+        response = self.client.get_object(Bucket=bucket, Key=key)
+        return response['Body'].read(), response['ETag']
+
+    def put(self, bucket, key, data, if_match=None):
+        """
+        write the object. With if_match, the write only succeeds if the stored object is still that version.
+        """
+        from botocore.exceptions import ClientError
+
+        kwargs = {'IfMatch': if_match} if if_match is not None else {}
+        try:
+            response = self.client.put_object(Bucket=bucket, Key=key, Body=data, **kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise VersionConflict(f"{bucket}/{key} was modified since version {if_match}") from e
+            raise
+        return response['ETag']
+
+
+class LocalModelStore(object):
+    """
+    stand-in for S3 backed by a local directory (<root>/<bucket>/<key>), with the same versioning and conditional put
+    semantics, so that concurrent agents can be run and checked without AWS. The version of an object is the quoted
+    md5 of its content, like an S3 ETag. Writers in different processes are serialized with a lock file per bucket.
+    without per_bucket, the keys of every bucket are stored directly under root (<root>/<key>), the layout of the
+    s3_backup directory.
+    """
+
+    def __init__(self, root, per_bucket=True):
+        self.root = root
+        self.per_bucket = per_bucket
+
+    def path(self, bucket, key):
+        if self.per_bucket:
+            return os.path.join(self.root, bucket, key)
+        return os.path.join(self.root, key)
+
+    @staticmethod
+    def etag(data):
+        return f'"{hashlib.md5(data).hexdigest()}"'
+
+    def head(self, bucket, key):
+        with open(self.path(bucket, key), 'rb') as model_file:
+            return self.etag(model_file.read())
+
+    def get(self, bucket, key):
+        with open(self.path(bucket, key), 'rb') as model_file:
+            data = model_file.read()
+        return data, self.etag(data)
+
+    def put(self, bucket, key, data, if_match=None):
+        path = self.path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(os.path.join(os.path.dirname(path), '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            if if_match is not None:
+                current = self.head(bucket, key) if os.path.exists(path) else None
+                if current != if_match:
+                    raise VersionConflict(f"{bucket}/{key} was modified since version {if_match}")
+
+            # write to a temporary file and rename it, so that readers never see a partially written model
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as model_file:
+                model_file.write(data)
+            os.replace(temp_path, path)
+
+        return self.etag(data)
@@ -0,0 +1,114 @@
+import json
+
+import numpy as np
+
+
+class NumpyBackend(object):
+    """
+    contextual bandit kept in numpy arrays: one ridge regression of the cost per arm (memory size), over the context
+    x = [1, log(1 + feature_1), ..., log(1 + feature_d)]. Like vw, the cost is minimized.
+
+    state, for K arms and d context dimensions:
+        A: (K, d, d) regularized gram matrix of the contexts each arm was observed with
+        b: (K, d) cost weighted sum of the contexts each arm was observed with
+        counts: (K,) number of observations per arm
+
+    algorithms:
+        - "epsilon_greedy": pick the arm with the lowest estimated cost, explore uniformly with probability epsilon
+        - "linucb": pick the arm with the lowest lower confidence bound theta.x - alpha * sqrt(x' A^-1 x)
+        - "thompson": sample theta ~ N(theta, v^2 A^-1) per arm and pick the lowest sampled cost. The pmf is estimated
+          from n_samples draws so that the logged probabilities stay usable for off-policy learning.
+    for every algorithm, epsilon mixes a uniform distribution into the pmf.
+    """
+    input_format = "array"
+
+    default_params = {
+        "epsilon_greedy": {"epsilon": 0.1, "regularization": 1.0},
+        "linucb": {"epsilon": 0.0, "regularization": 1.0, "alpha": 1.0},
+        "thompson": {"epsilon": 0.0, "regularization": 1.0, "v": 1.0, "n_samples": 100},
+    }
+
+    def __init__(self, n_actions: int, n_features: int, params: dict = None):
+        params = dict(params or {})
+        self.algorithm = params.pop("algorithm", "epsilon_greedy")
+        self.params = {**self.default_params[self.algorithm], **params}
+        self.rng = np.random.default_rng(self.params.pop("seed", None))
+
+        self.n_actions = n_actions
+        self.dim = n_features + 1  # +1 for the intercept
+        self.A = np.tile(np.eye(self.dim) * self.params["regularization"], (self.n_actions, 1, 1))
+        self.b = np.zeros((self.n_actions, self.dim))
+        self.counts = np.zeros(self.n_actions, dtype=np.int64)
+        self._A_inv = None
+
+    @staticmethod
+    def to_context(features):
+        """
+        features: (n, d) array of raw feature values -> (n, d + 1) contexts
+        """
+        features = np.log1p(np.asarray(features, dtype=np.float64))
+        return np.hstack([np.ones((features.shape[0], 1)), features])
+
+    def A_inv(self):
+        if self._A_inv is None:
+            self._A_inv = np.linalg.inv(self.A)
+        return self._A_inv
+
+    def learn_batch(self, examples):
+        """
+        examples: (features, actions, costs, probabilities), actions are 1-based as in vw
+        """
+        features, actions, costs, _ = examples
+        X = self.to_context(features)
+        arms = np.asarray(actions, dtype=np.int64) - 1
+        costs = np.asarray(costs, dtype=np.float64)
+
+        np.add.at(self.A, arms, np.einsum('ni,nj->nij', X, X))
+        np.add.at(self.b, arms, X * costs[:, None])
+        np.add.at(self.counts, arms, 1)
+        self._A_inv = None
+
+    def predict_batch(self, examples):
+        """
+        examples: (features, ...) -> (n, K) array, one pmf over the arms per context
+        """
+        X = self.to_context(examples[0])
+        A_inv = self.A_inv()
+        theta = np.einsum('kij,kj->ki', A_inv, self.b)
+
+        match self.algorithm:
+            case "epsilon_greedy":
+                greedy = self._one_hot(np.argmin(X @ theta.T, axis=1))
+            case "linucb":
+                width = np.sqrt(np.einsum('ni,kij,nj->nk', X, A_inv, X))
+                greedy = self._one_hot(np.argmin(X @ theta.T - self.params["alpha"] * width, axis=1))
+            case "thompson":
+                n_samples = self.params["n_samples"]
+                noise = self.rng.standard_normal((n_samples, self.n_actions, self.dim))
+                chol = np.linalg.cholesky(A_inv)
+                sampled_theta = theta + self.params["v"] * np.einsum('kij,skj->ski', chol, noise)
+                choices = np.argmin(np.einsum('ni,ski->snk', X, sampled_theta), axis=2)
+                greedy = self._one_hot(choices).mean(axis=0)
+
+        epsilon = self.params["epsilon"]
+        return (1 - epsilon) * greedy + epsilon / self.n_actions
+
+    def _one_hot(self, arms):
+        return np.eye(self.n_actions)[arms]
+
+    def save(self, path):
+        # write through a file object, np.savez would otherwise append .npz to the model file name
+        params = {**self.params, "algorithm": self.algorithm}
+        with open(path, 'wb') as model_file:
+            np.savez(model_file, A=self.A, b=self.b, counts=self.counts, params=json.dumps(params))
+
+    def load(self, path):
+        with np.load(path) as state:
+            params = json.loads(str(state["params"]))
+            self.algorithm = params.pop("algorithm")
+            self.params = params
+            self.A = state["A"]
+            self.b = state["b"]
+            self.counts = state["counts"]
+        self.n_actions, self.dim = self.b.shape
+        self._A_inv = None
@@ -0,0 +1,229 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from lambda_function import optimizer
+
+memory_list = [128, 256, 512, 1024, 2048]
+
+
+class LoggedData(object):
+    """
+    logged observations as arrays, n events over K memory sizes:
+        features: (n, d) raw feature values (payload_size)
+        actions: (n,) index of the memory size the function ran with, 0-based
+        costs: (n,) cost of the event, lower is better
+        propensities: (n,) probability the logging policy gave to that memory size
+    """
+
+    def __init__(self, features, actions, costs, propensities):
+        self.features = np.asarray(features, dtype=np.float64)
+        self.actions = np.asarray(actions, dtype=np.int64)
+        self.costs = np.asarray(costs, dtype=np.float64)
+        self.propensities = np.asarray(propensities, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.actions)
+
+
+def event_cost(payload, cost):
+    """
+    cost: "billed_duration" (ms) or "gb_seconds" (billed duration weighted by the memory size, what AWS charges for)
+    """
+    billed_duration = float(payload["billed_duration"])
+    match cost:
+        case "billed_duration":
+            return billed_duration
+        case "gb_seconds":
+            return billed_duration / 1000 * int(payload["memory_size"]) / 1024
+
+
+def to_logged_data(rows, cost="billed_duration"):
+    """
+    rows: (payload, probability) pairs, payload as stored in logs_processor_data and probability the
+    recommendation_record.probability dict ({"128": "0.9600", ...}) in effect when the event ran, or None when
+    unknown, in which case the memory size is assumed to have been picked uniformly.
+    """
+    features, actions, costs, propensities = [], [], [], []
+    for payload, probability in rows:
+        memory = int(payload["memory_size"])
+        features.append([int(payload["payload_size"])])
+        actions.append(memory_list.index(memory))
+        costs.append(event_cost(payload, cost))
+        propensities.append(float(probability[str(memory)]) if probability else 1 / len(memory_list))
+
+    return LoggedData(features, actions, costs, propensities)
+
+
+def load_jsonl(path, cost="billed_duration"):
+    """
+    one JSON object per line: a logs_processor_data payload, with an optional "probability" item holding the
+    recommendation_record.probability in effect when the event ran.
+    """
+    rows = []
+    with open(path) as records_file:
+        for line in records_file:
+            payload = json.loads(line)
+            rows.append((payload, payload.get("probability")))
+    return to_logged_data(rows, cost)
+
+
+def load_from_db(db_config, function_name, experiment_id=None, cost="billed_duration"):
+    """
+    read the processed events of a function, each with the probabilities of the last recommendation made before it
+    """
+    import psycopg2
+
+    query = '''
+    select l.payload,
+           (select r.probability
+              from recommendation_record r
+             where r.function_name = l.function_name
+               and r.experiment_id = l.experiment_id
+               and r.recorded_date <= l.created_date
+             order by r.recorded_date desc
+             limit 1)
+      from logs_processor_data l
+     where l.function_name = %s
+       and l.status is not null
+    '''
+    params = (function_name,)
+    if experiment_id:
+        query += ' and l.experiment_id = %s'
+        params += (experiment_id,)
+    query += ' order by l.created_date'
+
+    with psycopg2.connect(host=db_config['host'], dbname=db_config['db_name'],
+                          user=db_config['user'], password=db_config['pass']) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+
+    return to_logged_data(rows, cost)
+
+
+def fit_reward_model(data, n_actions, regularization=1.0):
+    """
+    direct method cost model: one ridge regression of the cost on [1, log(1 + features)] per memory size, fit on the
+    whole log. returns the (n, K) predicted cost of every memory size for every event.
+    """
+    X = np.hstack([np.ones((len(data), 1)), np.log1p(data.features)])
+    A = np.tile(np.eye(X.shape[1]) * regularization, (n_actions, 1, 1))
+    b = np.zeros((n_actions, X.shape[1]))
+    np.add.at(A, data.actions, np.einsum('ni,nj->nij', X, X))
+    np.add.at(b, data.actions, X * data.costs[:, None])
+
+    theta = np.linalg.solve(A, b[..., None])[..., 0]
+    return X @ theta.T
+
+
+def replay(agent, data, batch_size=1000):
+    """
+    stream the log through the agent in chunks: the pmf for every event of a chunk is predicted before the agent
+    learns that chunk (progressive validation), like the live agent that recommends and then observes.
+    returns the (n, K) pmfs.
+    """
+    pmfs = np.empty((len(data), agent.n_actions))
+
+    for start in range(0, len(data), batch_size):
+        chunk = slice(start, start + batch_size)
+
+        if agent.model.input_format == "array":
+            # the agent is built over memory_list, so its 1-based actions are the logged indexes + 1
+            features = data.features[chunk]
+            pmfs[chunk] = agent.model.predict_batch((features, None, None, None))
+            agent.model.learn_batch((features, data.actions[chunk] + 1, data.costs[chunk], data.propensities[chunk]))
+        else:
+            memories = [memory_list[action] for action in data.actions[chunk]]
+            requests = [{"bytes": int(features[0]), "memory": memory, "cost": cost, "probability": propensity}
+                        for features, memory, cost, propensity
+                        in zip(data.features[chunk], memories, data.costs[chunk], data.propensities[chunk])]
+            pmfs[chunk] = agent.model.predict_batch(agent.encode(requests, ["bytes"], True))
+            agent.observe_batch(requests)
+
+    pmfs /= pmfs.sum(axis=1, keepdims=True)
+    return pmfs
+
+
+def evaluate(pmfs, data, q, convergence_window=1000, convergence_tolerance=0.05):
+    """
+    policy value estimates (expected cost per event, lower is better) of the replayed policy:
+        - logged: average cost of the logging policy
+        - ips: inverse propensity scoring, and snips its self-normalized variant
+        - dm: direct method, the policy's expected cost under the reward model q
+        - dr: doubly robust, dm corrected with the ips-weighted residuals of q
+    regret is the policy's expected cost under q minus the cost of the best memory size under q, per event.
+    convergence is the first event after which the moving average regret over convergence_window events stays below
+    convergence_tolerance times the average best cost, or None if it never does.
+    """
+    events = np.arange(len(data))
+    weights = pmfs[events, data.actions] / data.propensities
+    q_logged = q[events, data.actions]
+    dm_per_event = (pmfs * q).sum(axis=1)
+
+    regret = dm_per_event - q.min(axis=1)
+    cumulative_regret = np.cumsum(regret)
+
+    window = min(convergence_window, len(data))
+    moving_regret = np.convolve(regret, np.ones(window) / window, mode='valid')
+    above = np.flatnonzero(moving_regret > convergence_tolerance * q.min(axis=1).mean())
+    if not len(above):
+        convergence = 0
+    elif above[-1] + 1 < len(moving_regret):
+        convergence = int(above[-1] + 1)
+    else:
+        convergence = None
+
+    return {
+        "events": len(data),
+        "logged": float(data.costs.mean()),
+        "ips": float((weights * data.costs).mean()),
+        "snips": float((weights * data.costs).sum() / weights.sum()),
+        "dm": float(dm_per_event.mean()),
+        "dr": float((dm_per_event + weights * (data.costs - q_logged)).mean()),
+        "total_regret": float(cumulative_regret[-1]),
+        "convergence_event": convergence,
+        "cumulative_regret": cumulative_regret,
+    }
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Replay logged function events through a CMAB agent and estimate its policy value offline.')
+    parser.add_argument('--records', help='JSON lines file of logged payloads (see load_jsonl)')
+    parser.add_argument('--funk-name', help='Read the events of this function from the database configured in dfaastest/config.yaml instead')
+    parser.add_argument('--experiment-id', help='Only replay the events of this experiment')
+    parser.add_argument('--cost', default='billed_duration', choices=['billed_duration', 'gb_seconds'])
+    parser.add_argument('--backend', default='numpy', choices=['vw', 'numpy'])
+    parser.add_argument('--backend-params', type=json.loads, default=None, help='JSON object, e.g. \'{"algorithm": "linucb"}\'')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Number of events predicted before the agent learns them')
+    parser.add_argument('--regret-csv', help='Write the cumulative regret curve to this file')
+
+    args = parser.parse_args()
+
+    if args.records:
+        data = load_jsonl(args.records, args.cost)
+    else:
+        import yaml
+        with open('dfaastest/config.yaml') as config_file:
+            db_config = yaml.safe_load(config_file)['database']
+        data = load_from_db(db_config, args.funk_name, args.experiment_id, args.cost)
+
+    agent = optimizer(memory_list, "time", ["bytes"], "replay", "/tmp",
+                      backend=args.backend, backend_params=args.backend_params)
+
+    start = time.perf_counter()
+    pmfs = replay(agent, data, args.batch_size)
+    replay_time = time.perf_counter() - start
+
+    results = evaluate(pmfs, data, fit_reward_model(data, len(memory_list)))
+    cumulative_regret = results.pop("cumulative_regret")
+
+    print(f"replayed {len(data)} events in {replay_time:.2f}s ({len(data) / replay_time:.0f} events/s)")
+    for name, value in results.items():
+        print(f"{name:<18} {value}")
+
+    if args.regret_csv:
+        np.savetxt(args.regret_csv, cumulative_regret, delimiter=',', header='cumulative_regret', comments='')
@@ -0,0 +1,110 @@
+import argparse
+import itertools
+import json
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import yaml
+
+from lambda_function import optimizer
+from replay import evaluate, fit_reward_model, load_from_db, load_jsonl, memory_list, replay
+
+# hyperparameter grids per backend, every combination is one configuration
+default_grids = {
+    "vw": {
+        "epsilon": [0.01, 0.05, 0.1, 0.2],
+        "power_t": [0, 0.5, 1],
+        "learning_rate": [0.1, 0.5, 1, 2],
+        "decay_learning_rate": [1],
+    },
+    "numpy": {
+        "algorithm": ["epsilon_greedy", "linucb", "thompson"],
+        "epsilon": [0.0, 0.05, 0.1],
+        "regularization": [0.1, 1.0, 10.0],
+    },
+}
+
+# set by init_worker in every pool process
+worker_data = {}
+worker_q = {}
+
+
+def expand_grid(grid):
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def init_worker(data_sets):
+    """
+    the logged data is sent once to every pool process instead of with every configuration
+    """
+    worker_data.update(data_sets)
+    for funk_name, data in data_sets.items():
+        worker_q[funk_name] = fit_reward_model(data, len(memory_list))
+
+
+def run_config(funk_name, backend, params, batch_size):
+    """
+    replay one function's log through a fresh agent (one vw workspace per configuration) and score it
+    """
+    start = time.perf_counter()
+    agent = optimizer(memory_list, "time", ["bytes"], f"sweep_{funk_name}", "/tmp",
+                      backend=backend, backend_params=params)
+    pmfs = replay(agent, worker_data[funk_name], batch_size)
+    results = evaluate(pmfs, worker_data[funk_name], worker_q[funk_name])
+    results.pop("cumulative_regret")
+
+    return {"funk_name": funk_name, "backend": backend, "params": params,
+            "seconds": time.perf_counter() - start, **results}
+
+
+if __name__ == '__main__':
+
+    with open('dfaastest/config.yaml') as config_file:
+        config = yaml.safe_load(config_file)
+
+    parser = argparse.ArgumentParser(description='Sweep the CMAB agent hyperparameters over logged data, in parallel, and report the best configuration per function.')
+    parser.add_argument('--funk-names', nargs='+', default=list(config['funk_generator']), help='Functions to tune, read from the database')
+    parser.add_argument('--records', nargs='+', default=[], help='Use JSON lines exports instead of the database, as funk_name=path')
+    parser.add_argument('--backend', default='vw', choices=list(default_grids))
+    parser.add_argument('--grid', type=json.loads, help='JSON object of parameter name -> list of values, replaces the default grid')
+    parser.add_argument('--random', type=int, help='Sample this many configurations from the grid instead of running all of them')
+    parser.add_argument('--score', default='dr', choices=['dr', 'ips', 'snips', 'dm', 'total_regret'], help='Estimate to minimize')
+    parser.add_argument('--batch-size', type=int, default=100, help='Number of events predicted before the agent learns them')
+    parser.add_argument('--workers', type=int, help='Number of worker processes, defaults to the number of CPUs')
+    parser.add_argument('--output', help='Write every configuration result to this JSON lines file')
+
+    args = parser.parse_args()
+
+    if args.records:
+        data_sets = {funk_name: load_jsonl(path) for funk_name, path in (record.split('=', 1) for record in args.records)}
+    else:
+        data_sets = {funk_name: load_from_db(config['database'], funk_name) for funk_name in args.funk_names}
+
+    configs = expand_grid(args.grid or default_grids[args.backend])
+    if args.random and args.random < len(configs):
+        configs = random.sample(configs, args.random)
+    print(f"sweeping {len(configs)} configurations over {', '.join(data_sets)}")
+
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(args.workers, initializer=init_worker, initargs=(data_sets,)) as pool:
+        futures = [pool.submit(run_config, funk_name, args.backend, params, args.batch_size)
+                   for funk_name in data_sets for params in configs]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print(f"{result['funk_name']:<24} {args.score}: {result[args.score]:12.4f}  "
+                  f"{result['seconds']:7.2f}s  {json.dumps(result['params'])}")
+    print(f"sweep finished in {time.perf_counter() - start:.1f}s")
+
+    for funk_name in data_sets:
+        best = min((result for result in results if result['funk_name'] == funk_name), key=lambda result: result[args.score])
+        print(f"best for {funk_name}: {json.dumps(best['params'])} ({args.score}: {best[args.score]:.4f}, "
+              f"logged: {best['logged']:.4f}, convergence at event {best['convergence_event']})")
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            for result in results:
+                output_file.write(json.dumps(result) + '\n')
@@ -0,0 +1,30 @@
+import vowpalwabbit as vw
+
+
+class VWBackend(object):
+    """
+    contextual bandit backed by a vowpalwabbit --cb_explore workspace.
+    examples are vw-formatted strings, see optimizer.convert_to_vw_format.
+    """
+    input_format = "vw"
+
+    default_params = {"power_t": 1, "decay_learning_rate": 1, "epsilon": 0.1}
+
+    def __init__(self, n_actions: int, n_features: int, params: dict = None):
+        self.n_actions = n_actions
+        self.params = {**self.default_params, **(params or {})}
+        arguments = " ".join(f"--{name} {value}" for name, value in self.params.items())
+        self.workspace = vw.Workspace(f"--cb_explore {self.n_actions} {arguments}", quiet=True, enable_logging=True)
+
+    def learn_batch(self, examples):
+        for example in examples:
+            self.workspace.learn(example)
+
+    def predict_batch(self, examples):
+        return [self.workspace.predict(example) for example in examples]
+
+    def save(self, path):
+        self.workspace.save(path)
+
+    def load(self, path):
+        self.workspace = vw.Workspace(f"-i {path}", enable_logging=True)
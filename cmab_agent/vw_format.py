@@ -0,0 +1,62 @@
+from operator import itemgetter
+
+
+class VWExampleBuilder(object):
+    """
+    builds vw text examples from requests.
+    the layout of an example only depends on the feature keys and on whether it is labeled, so a %-format template
+    and a feature getter are compiled once per layout and reused, instead of concatenating the example piece by piece.
+        labeled:   "<action>:<cost>:<probability> | <feature_1> <feature_2> ..."
+        predict:   "| <feature_1> <feature_2> ..."
+    """
+
+    def __init__(self, mem2action: dict):
+        self.mem2action = mem2action
+        self.layouts = {}
+
+    def layout(self, feature_keys: list, predict_mode: bool):
+        key = (tuple(feature_keys), predict_mode)
+        try:
+            return self.layouts[key]
+        except KeyError:
+            features = " %s" * len(feature_keys)
+            template = "|" + features if predict_mode else "%s:%s:%s |" + features
+
+            # itemgetter returns a bare value rather than a tuple for a single key
+            if len(feature_keys) == 1:
+                feature_key = feature_keys[0]
+                getter = lambda request: (request[feature_key],)
+            elif feature_keys:
+                getter = itemgetter(*feature_keys)
+            else:
+                getter = lambda request: ()
+
+            self.layouts[key] = (template, getter)
+            return self.layouts[key]
+
+    def build(self,
+              request,
+              feature_keys: list,
+              predict_mode = False,
+              mem_key: str = None,
+              cost_key:str = None,
+              prob_key: str = None):
+        template, getter = self.layout(feature_keys, predict_mode)
+        if predict_mode:
+            return template % getter(request)
+        return template % (self.mem2action[request[mem_key]], request[cost_key], request[prob_key], *getter(request))
+
+    def build_batch(self,
+                    requests: list,
+                    feature_keys: list,
+                    predict_mode = False,
+                    mem_key: str = None,
+                    cost_key:str = None,
+                    prob_key: str = None):
+        template, getter = self.layout(feature_keys, predict_mode)
+        if predict_mode:
+            return [template % getter(request) for request in requests]
+
+        mem2action = self.mem2action
+        return [template % (mem2action[request[mem_key]], request[cost_key], request[prob_key], *getter(request))
+                for request in requests]
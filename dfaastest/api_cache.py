@@ -0,0 +1,48 @@
+import argparse
+import json
+
+from utils import lambda_utils
+from utils.config_utils import get_funk_names, get_config
+
+
+def api_configs(config, funk_name=None):
+    """
+    (name, api config) of every function of funk_generator, or only funk_name, and of the cmab agent
+    """
+    funk_names = [funk_name] if funk_name else list(config['funk_generator'])
+    configs = [(name, config['funk_generator'][name]) for name in funk_names]
+    if not funk_name:
+        configs.append(('cmab_agent', config['cmab_agent']))
+    return configs
+
+
+if __name__ == '__main__':
+
+    funk_names = get_funk_names()
+
+    parser = argparse.ArgumentParser(description='Resolve the API URLs of the functions and the cmab agent ahead of the experiments, or invalidate them.')
+    parser.add_argument('--action', choices=['warm', 'invalidate', 'show'], default='warm',
+                        help='warm: resolve and cache the URLs (again with --refresh), invalidate: drop the cached URLs, show: print the cache')
+    parser.add_argument('--funk-name', choices=funk_names, help='Only this function (default: every function and the cmab agent)')
+    parser.add_argument('--refresh', action='store_true', help='Look the URLs up again even when they are cached')
+
+    args = parser.parse_args()
+
+    config = get_config()
+
+    match args.action:
+        case 'warm':
+            for name, api_config in api_configs(config, args.funk_name):
+                url = lambda_utils.resolve_api_url(api_config['api_name'], api_config['api_stage'], api_config['api_base_path'], refresh=args.refresh)
+                print(f"{name}: {url}")
+
+        case 'invalidate':
+            if args.funk_name:
+                api_config = config['funk_generator'][args.funk_name]
+                lambda_utils.invalidate_api_url(api_config['api_name'], api_config['api_stage'], api_config['api_base_path'])
+            else:
+                lambda_utils.invalidate_api_url()
+            print(f"invalidated the cached API URLs in {lambda_utils.api_cache_path}")
+
+        case 'show':
+            print(json.dumps(lambda_utils.read_api_cache(), indent=2))
@@ -0,0 +1,102 @@
+import asyncio
+
+from cmab_client import CmabClient
+
+
+class AsyncCmabClient(CmabClient):
+    """
+    asyncio variant of CmabClient, with the same send_observe / send_observe_batch / send_recommend / send_flush
+    methods as coroutines. Requests go through the pooled HttpTransport on worker threads, up to max_in_flight at once.
+
+    vw learns observations in the order it receives them: with ordered_observes, observes are sent one after another in
+    the order they were submitted, while recommends keep flowing next to them. Without it observes are sent
+    concurrently too, which relies on the agent merging concurrent model writes.
+
+    the initial recommendation needs the event loop: call `await client.start()` before using the client.
+    """
+
+    def __init__(self, cmab_config, debug=False, dryrun=False):
+        async_config = cmab_config.get('async', {})
+        self.max_in_flight = async_config.get('max_in_flight', 8)
+        self.ordered_observes = async_config.get('ordered_observes', True)
+        self.observe_chunk_size = async_config.get('observe_chunk_size', 0)  # 0 = the whole backlog in one request
+
+        # keep enough pooled connections for every request in flight
+        http_config = cmab_config.get('http') or {}
+        cmab_config = {**cmab_config, 'http': {**http_config, 'pool_size': max(http_config.get('pool_size', 10), self.max_in_flight)}}
+
+        # the asyncio primitives belong to the event loop they are first used in, see limits()
+        self.loop = None
+        self.in_flight = None
+        self.observe_lock = None
+
+        super().__init__(cmab_config, debug, dryrun)
+
+    def initialize(self):
+        # deferred to start(), there may be no running event loop yet
+        pass
+
+    async def start(self):
+        recommendation = await self.send_recommend({"payload_size": 1})
+        print(f"AsyncCmabClient.start - recommendation: {recommendation}")
+        self.memory = recommendation['recommended_memory']
+        self.update_probabilities(recommendation)
+
+    def limits(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.in_flight = asyncio.Semaphore(self.max_in_flight)
+            self.observe_lock = asyncio.Lock()
+        return self.in_flight, self.observe_lock
+
+    async def send_request(self, payload, idempotent=True):
+        in_flight, _ = self.limits()
+        async with in_flight:
+            return await asyncio.to_thread(CmabClient.send_request, self, payload, idempotent)
+
+    async def send_observe_request(self, request_payload, idempotent=False):
+        _, observe_lock = self.limits()
+        if self.ordered_observes:
+            # asyncio.Lock wakes its waiters first in, first out, so the submission order is kept
+            async with observe_lock:
+                return await self.send_request(request_payload, idempotent)
+        return await self.send_request(request_payload, idempotent)
+
+    async def send_observe(self, payload):
+        request_payload = {"Event": {**self.request_observe_templates["Event"], "Request": self.build_observation(payload)}}
+        self.recommend_cache.observed()
+        return await self.send_observe_request(request_payload)
+
+    async def send_observe_batch(self, payloads):
+        probability_dict = self.probability_dict
+        request_payload = {"Event": {**self.request_observe_batch_templates["Event"],
+                                     "Requests": [self.build_observation(payload, probability_dict) for payload in payloads]}}
+        self.recommend_cache.observed(len(payloads))
+        return await self.send_observe_request(request_payload)
+
+    async def observe_backlog(self, payloads):
+        """
+        observe a backlog of any size as observe_batch requests of observe_chunk_size observations, pipelined. Ordered
+        observes would send the chunks one after another, more round trips than the one request of the whole backlog
+        (as the sync worker sends it): the backlog is only split with unordered observes
+        """
+        if self.ordered_observes or not self.observe_chunk_size:
+            chunks = [payloads]
+        else:
+            chunks = [payloads[i:i + self.observe_chunk_size] for i in range(0, len(payloads), self.observe_chunk_size)]
+        print(f'observe_backlog - observations: {len(payloads)}, requests: {len(chunks)}')
+        return await asyncio.gather(*(self.send_observe_batch(chunk) for chunk in chunks))
+
+    async def send_flush(self):
+        return await self.send_observe_request(self.request_flush_templates, idempotent=True)
+
+    async def send_recommend(self, payload):
+        recommendation = self.recommend_cache.get(payload["payload_size"])
+        if recommendation is not None:
+            return recommendation
+
+        request_payload = {"Event": {**self.request_recommend_templates["Event"], "Request": {"bytes": payload["payload_size"]}}}
+        recommendation_response = await self.send_request(request_payload)
+        self.recommend_cache.put(payload["payload_size"], recommendation_response['result'])
+        return recommendation_response['result']
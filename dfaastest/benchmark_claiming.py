@@ -0,0 +1,120 @@
+import argparse
+import time
+from multiprocessing import Process, Queue
+
+import psycopg2
+
+from benchmark_poll_query import create_schema, load_records
+from migrate import migration_files
+from utils.database import DB
+
+schema = 'bench_claiming'
+
+
+def run_worker(db_params, worker_id, batch_size, batch_seconds, lease_seconds, results):
+    """
+    process batches like DfaastestOperator.process_batch until the backlog is empty, the agent and Lambda calls of a
+    batch simulated by sleeping batch_seconds
+    """
+    db = DB(**db_params)
+    db.execute(f'set search_path to {schema}, public')
+    claimed = updated = batches = 0
+
+    while True:
+        with db.transaction():
+            db.lease(lease_seconds)
+            records = db.claim_records('funk_0', batch_size)
+            if records:
+                time.sleep(batch_seconds)
+                with db.postgres.cursor() as cursor:
+                    # only records nobody processed yet: fewer rows updated than claimed means a record was claimed twice
+                    cursor.execute("update logs_processor_data set status = 'P', experiment_id = %s where request_id = any(%s) and status is null",
+                                   (f'worker_{worker_id}', [record[0] for record in records]))
+                    updated += cursor.rowcount
+                claimed += len(records)
+                batches += 1
+
+        if not records:
+            break
+
+    results.put((worker_id, claimed, updated, batches))
+
+
+def run_workers(db_params, workers, batch_size, batch_seconds, lease_seconds):
+    results = Queue()
+    processes = [Process(target=run_worker, args=(db_params, worker_id, batch_size, batch_seconds, lease_seconds, results))
+                 for worker_id in range(workers)]
+
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return time.perf_counter() - start, outcomes
+
+
+def simulate_stall(db_params, batch_size, lease_seconds):
+    """
+    a worker claims a batch and stalls: its records are released to the others once its lease expires
+    """
+    stalled, other = DB(**db_params), DB(**db_params)
+    for db in (stalled, other):
+        db.execute(f'set search_path to {schema}, public')
+
+    session_ended = None
+    try:
+        with stalled.transaction():
+            stalled.lease(lease_seconds)
+            claimed = stalled.claim_records('funk_0', batch_size)
+            with other.transaction():
+                during = other.claim_records('funk_0', batch_size)
+            time.sleep(lease_seconds + 1)
+            with other.transaction():
+                after = other.claim_records('funk_0', batch_size)
+            stalled.query('select 1', ())  # the stalled worker resumes
+    except psycopg2.Error as e:
+        session_ended = type(e).__name__
+
+    return len(claimed), len(during), len(after), session_ended
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Measure the throughput of 1 to 8 workers splitting a backlog with SKIP LOCKED claiming, against a local scratch Postgres database.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--db', default='postgres')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default='postgres')
+    parser.add_argument('--records', type=int, default=5000, help='Backlog of unprocessed records')
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--batch-seconds', type=float, default=0.2, help='Simulated agent and Lambda time per batch')
+    parser.add_argument('--lease-seconds', type=float, default=5)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+
+    args = parser.parse_args()
+
+    db_params = dict(host=args.host, db=args.db, user=args.user, password=args.password)
+    db = DB(**db_params)
+
+    for workers in args.workers:
+        create_schema(db, schema, migration_files())
+        db.execute("select create_logs_processor_data_partitions(localtimestamp - interval '1 day', localtimestamp + interval '1 month')")
+        load_records(db, schema, args.records, 1, 1, args.records)
+
+        seconds, outcomes = run_workers(db_params, workers, args.batch_size, args.batch_seconds, args.lease_seconds)
+        claimed = sum(outcome[1] for outcome in outcomes)
+        updated = sum(outcome[2] for outcome in outcomes)
+        print(f"{workers} workers: {args.records / seconds:8.0f} records/s ({seconds:.2f} s), claimed: {claimed}, "
+              f"processed: {updated}, claimed twice: {claimed - updated}, "
+              f"batches per worker: {sorted(outcome[3] for outcome in outcomes)}")
+
+    # crash recovery: the records of a stalled worker go to the others once its lease expires
+    create_schema(db, schema, migration_files())
+    db.execute("select create_logs_processor_data_partitions(localtimestamp - interval '1 day', localtimestamp + interval '1 month')")
+    load_records(db, schema, args.batch_size, 1, 1, args.batch_size)
+    claimed, during, after, session_ended = simulate_stall(db_params, args.batch_size, args.lease_seconds)
+    print(f"stalled worker claimed {claimed} records, the others claimed {during} during its lease and {after} after it "
+          f"(stalled worker's session ended: {session_ended})")
+
+    db.execute(f'drop schema {schema} cascade')
@@ -0,0 +1,77 @@
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+
+from async_cmab_client import AsyncCmabClient
+from cmab_client import CmabClient
+from utils.config_utils import get_config
+from utils.stub_agent import StubAgent
+
+
+def make_payloads(n):
+    return [{"memory_size": random.choice(CmabClient.mem_list), "billed_duration": str(random.randint(100, 1000)),
+             "payload_size": random.randint(1, 100)} for _ in range(n)]
+
+
+def run_sync(cmab_config, payloads, batch=False):
+    client = CmabClient(cmab_config)
+    start = time.perf_counter()
+    if batch:
+        # the worker's path: the whole backlog in one observe_batch
+        client.send_observe_batch(payloads)
+    else:
+        for payload in payloads:
+            client.send_observe(payload)
+    return time.perf_counter() - start
+
+
+async def run_async(cmab_config, payloads, chunk_size):
+    client = AsyncCmabClient(cmab_config)
+    client.observe_chunk_size = chunk_size
+    await client.start()
+    start = time.perf_counter()
+    await client.observe_backlog(payloads)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+
+    config = get_config()
+
+    parser = argparse.ArgumentParser(description='Compare sequential and pipelined observe throughput of the CMAB client against a local stub agent.')
+    parser.add_argument('--n', type=int, default=500, help='Number of observations in the backlog')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds the stub agent takes per request')
+    parser.add_argument('--max-in-flight', type=int, default=16)
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--embedded', action='store_true', help='Also time the agent running in process (needs the agent backend installed)')
+
+    args = parser.parse_args()
+
+    stub = StubAgent(port=args.port, latency=args.latency)
+    stub.start_in_thread()
+    time.sleep(0.5)
+
+    cmab_config = {**config['cmab_agent'], 'model_funk': 'benchmark', 'model_experiment': 'stub', 'api_url': stub.url,
+                   'slo': {'benchmark': 500}}
+    payloads = make_payloads(args.n)
+
+    results = {
+        "sync, one observe per request": run_sync(cmab_config, payloads),
+        "sync, one observe_batch": run_sync(cmab_config, payloads, batch=True),
+    }
+    # ordered observes always send the backlog in one observe_batch, whatever the chunk size
+    cmab_config['async'] = {'max_in_flight': args.max_in_flight, 'ordered_observes': True}
+    results["async ordered, one observe_batch"] = asyncio.run(run_async(cmab_config, payloads, 0))
+    cmab_config['async'] = {'max_in_flight': args.max_in_flight, 'ordered_observes': False}
+    results["async unordered, one observe per request"] = asyncio.run(run_async(cmab_config, payloads, 1))
+    results["async unordered, observe_batch of 50"] = asyncio.run(run_async(cmab_config, payloads, 50))
+
+    if args.embedded:
+        embedded_config = {**cmab_config, 'mode': 'embedded', 'embedded': {'model_dir': tempfile.mkdtemp()}}
+        results["embedded, one observe per request"] = run_sync(embedded_config, payloads)
+        results["embedded, one observe_batch"] = run_sync(embedded_config, payloads, batch=True)
+
+    for name, seconds in results.items():
+        print(f"{name:<40} {seconds:7.2f}s  {args.n / seconds:8.0f} observations/s")
@@ -0,0 +1,98 @@
+import argparse
+import statistics
+import time
+
+from migrate import migration_files
+from utils.database import DB
+
+poll_query = '''
+    select *
+      from logs_processor_data
+     where status is null
+       and function_name = %s
+     order by created_date
+'''
+
+
+def create_schema(db, schema, migrations):
+    """
+    a scratch schema with logs_processor_data built by the given migrations
+    """
+    db.execute(f'drop schema if exists {schema} cascade')
+    db.execute(f'create schema {schema}')
+    db.execute(f'set search_path to {schema}, public')
+    for version, path in migrations:
+        with open(path) as migration_file:
+            db.execute(migration_file.read())
+
+
+def load_records(db, schema, rows, functions, days, unprocessed):
+    """
+    rows records spread over the last days, round robin over the functions, the newest `unprocessed` ones not
+    processed yet (status null), like a long running experiment history with a small backlog
+    """
+    db.execute(f'set search_path to {schema}, public')
+    db.execute('''
+        insert into logs_processor_data (request_id, function_name, payload, created_date, status, experiment_id)
+        select md5(i::text),
+               'funk_' || (i %% %s),
+               jsonb_build_object('payload_size', i %% 100, 'memory_size', 128, 'billed_duration', '100'),
+               localtimestamp - (%s - i) * (%s * interval '1 day' / %s),
+               case when i > %s - %s then null else 'P' end,
+               case when i > %s - %s then null else 'benchmark' end
+          from generate_series(1, %s) as i
+    ''', (functions, rows, days, rows, rows, unprocessed, rows, unprocessed, rows))
+    db.execute('analyze logs_processor_data')
+
+
+def time_poll(db, schema, repetitions):
+    db.execute(f'set search_path to {schema}, public')
+    plan = db.query('explain (analyze, buffers) ' + poll_query, ('funk_0',))
+
+    latencies = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        db.query(poll_query, ('funk_0',))
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+
+    return '\n'.join(row[0] for row in plan), statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compare the worker poll query on the baseline and on the migrated logs_processor_data schema, against a local scratch Postgres database.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--db', default='postgres')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default='postgres')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--functions', type=int, default=5)
+    parser.add_argument('--days', type=int, default=90, help='Days of history the records are spread over')
+    parser.add_argument('--unprocessed', type=int, default=500, help='Records waiting to be polled, the newest ones')
+    parser.add_argument('--repetitions', type=int, default=50)
+
+    args = parser.parse_args()
+
+    db = DB(host=args.host, db=args.db, user=args.user, password=args.password)
+    migrations = migration_files()
+    schemas = {
+        'baseline (001-002)': ('bench_baseline', [m for m in migrations if int(m[0]) <= 2]),
+        f'migrated (001-{migrations[-1][0]})': ('bench_migrated', migrations),
+    }
+
+    results = {}
+    for name, (schema, schema_migrations) in schemas.items():
+        print(f"{name}: loading {args.rows} records into {schema}...")
+        create_schema(db, schema, schema_migrations)
+        if schema_migrations is migrations:
+            # partitions over the whole history, not only the months around the migration
+            db.execute("select create_logs_processor_data_partitions(localtimestamp - %s * interval '1 day', localtimestamp + interval '1 month')", (args.days,))
+        load_records(db, schema, args.rows, args.functions, args.days, args.unprocessed)
+        results[name] = time_poll(db, schema, args.repetitions)
+
+    for name, (plan, median, p95) in results.items():
+        print(f"\n{name} - poll latency median: {median:.2f} ms, p95: {p95:.2f} ms\n{plan}")
+
+    for schema, _ in schemas.values():
+        db.execute(f'drop schema {schema} cascade')
@@ -1,9 +1,10 @@
+import copy
 import json
-from copy import deepcopy
 
-import requests
-
-from utils.lambda_utils import get_region_name, construct_api_url, get_rest_api
+from utils.embedded_agent import EmbeddedAgent
+from utils.http_utils import HttpTransport
+from utils.lambda_utils import resolve_api_url
+from utils.recommendation_cache import RecommendationCache
 
 
 class CmabClient(object):
@@ -48,6 +49,19 @@ class CmabClient(object):
         }
     }
 
+    request_observe_batch_templates = {
+        "Event": {
+            "action": "observe_batch",
+            "Requests": [],
+        }
+    }
+
+    request_flush_templates = {
+        "Event": {
+            "action": "flush",
+        }
+    }
+
     request_recommend_templates = {
         "Event": {
             "action": "recommend",
@@ -61,7 +75,7 @@ class CmabClient(object):
     memory = 0
     probability = 0.0
 
-    def __init__(self, cmab_config, debug=False, dryrun=False):
+    def __init__(self, cmab_config, debug=False, dryrun=False, transport=None):
         print(f"CmabClient")
         self.cmab_config = cmab_config
         self.debug = debug
@@ -74,48 +88,99 @@ class CmabClient(object):
         self.slo = self.cmab_config['slo']
 
         self.model_name = f"{self.model_funk}_{self.model_experiment}"
+        # each client has its own copy, several clients (functions) can share a process
+        self.request_templates = copy.deepcopy(self.request_templates)
         self.request_templates['Event']['S3']['key'] = f"{self.model_name}.model"
         self.request_templates['Event']['config']['model_name'] = self.model_name
+        for option in ('backend', 'backend_params', 'checkpoint', 'seed'):
+            if option in self.cmab_config:
+                self.request_templates['Event']['config'][option] = self.cmab_config[option]
+
+        # the S3, Keys and config parts of every request never change, they are serialized once per set of keys the
+        # action overrides (see serialize_request)
+        self.serialized_templates = {}
+        self.recommend_cache = RecommendationCache(self.cmab_config.get('recommend_cache'), self.mem_list, self.cmab_config.get('seed'))
+
+        self.mode = self.cmab_config.get('mode', 'api')
+        match self.mode:
+            case 'api':
+                # a transport can be shared by the clients of a process, see multi_operator.py
+                self.transport = transport or HttpTransport(self.cmab_config.get('http'))
+                if self.cmab_config.get('api_url'):
+                    # talk to an agent outside API Gateway, e.g. agent_server.py or the stub agent
+                    self.rest_api_url = self.cmab_config['api_url']
+                else:
+                    self.rest_api_url = resolve_api_url(self.cmab_config['api_name'], self.cmab_config['api_stage'], self.cmab_config['api_base_path'])
+            case 'embedded':
+                # the agent runs in this process, see utils.embedded_agent; shared by the clients of a process too
+                self.transport = transport or EmbeddedAgent(self.cmab_config.get('embedded'))
+                self.transport.create_model_if_missing(self.request_templates['Event'])
+                self.rest_api_url = 'embedded'
+        print(f"CmabClient.__init__ - mode: {self.mode}, rest_api_url: {self.rest_api_url}")
 
-        self.api = get_rest_api(self.cmab_config['api_name'])
-        self.rest_api_url = construct_api_url(self.api['id'], get_region_name(), self.cmab_config['api_stage'], self.cmab_config['api_base_path'])
-        print(f"CmabClient.__init__ - rest_api_url: {self.rest_api_url}")
+        self.initialize()
 
+    def initialize(self):
         # Initialize the client for memory and probability from the CmabAgent
         recommendation = self.send_recommend({"payload_size": 1}) # TODO get a recommendation based on DB data
-        print(f"CmabClient.__init__ - recommendation: {recommendation}")
+        print(f"CmabClient.initialize - recommendation: {recommendation}")
         self.memory = recommendation['recommended_memory']
+        self.update_probabilities(recommendation)
+
+    def update_probabilities(self, recommendation):
         self.probability = recommendation['action_probability']
         self.probability_dict = {self.mem_list[i]: recommendation['probability_list'][i] for i in range(len(self.mem_list))}
 
-    def send_request(self, payload):
+    def send_request(self, payload, idempotent=True):
         if not self.dryrun:
 
-            request_payload = deepcopy(self.request_templates)
-            request_payload["Event"] = { **request_payload["Event"], **payload["Event"] }
+            request_payload = self.serialize_request(payload)
 
-            print(f'send_request - request_payload: {request_payload}')
+            if self.debug:
+                print(f'send_request - request_payload: {request_payload}')
 
-            r = requests.post(self.rest_api_url, data=json.dumps(request_payload))
+            r = self.transport.post(self.rest_api_url, data=request_payload, idempotent=idempotent)
 
             res = r.json()['body']
 
             if self.debug:
                 print(f"CmabClient.send_request - response JSON body: {res}")
+                print(f"CmabClient.send_request - {self.transport.latency_summary()}")
 
             return res
         else:
             print(f"send_request - api: {self.rest_api_url}; payload: {json.dumps(payload)}")
             return None
 
-    def send_observe(self, payload):
-        request_payload = deepcopy(self.request_observe_templates)
-        request_payload["Event"]["Request"]["memory"] = payload["memory_size"]
-        request_payload["Event"]["Request"]["probability"] = self.probability_dict[payload["memory_size"]]
+    def serialize_request(self, payload):
+        """
+        JSON of the request template merged with the payload's Event items, the payload taking precedence.
+        equivalent to json.dumps({"Event": {**template_event, **payload_event}}) without re-serializing the template.
+        """
+        event = payload["Event"]
+        overridden = tuple(sorted(event))
+
+        static = self.serialized_templates.get(overridden)
+        if static is None:
+            static = ", ".join(f"{json.dumps(name)}: {json.dumps(value)}"
+                               for name, value in self.request_templates["Event"].items() if name not in event)
+            self.serialized_templates[overridden] = static
+
+        parts = [part for part in (static, json.dumps(event)[1:-1]) if part]
+        return '{"Event": {' + ', '.join(parts) + '}}'
+
+    def build_observation(self, payload, probability_dict=None):
+        """
+        probability_dict: the probabilities of a batch's observations, read once so that they all come from the same
+        recommendation even if update_probabilities runs on another thread meanwhile. The current ones by default
+        """
+        observation = dict(self.request_observe_templates["Event"]["Request"])
+        observation["memory"] = payload["memory_size"]
+        observation["probability"] = (probability_dict or self.probability_dict)[payload["memory_size"]]
 
         match self.optimization_goal:
             case 'billed_duration':
-                request_payload["Event"]["Request"]["cost"] = 1000/int(payload["billed_duration"])  # 300*1/time
+                observation["cost"] = 1000/int(payload["billed_duration"])  # 300*1/time
             case 'slo':
                 cost = int(payload["billed_duration"])
                 slo = self.slo[self.model_funk]
@@ -123,20 +188,48 @@ class CmabClient(object):
                     cost = 1/cost  # penalization
                 else:
                     cost = slo - cost
-                request_payload["Event"]["Request"]["cost"] = cost
+                observation["cost"] = cost
+
+        observation["bytes"] = payload["payload_size"]
+
+        return observation
 
-        request_payload["Event"]["Request"]["bytes"] = payload["payload_size"]
+    def send_observe(self, payload):
+        request_payload = {"Event": {**self.request_observe_templates["Event"], "Request": self.build_observation(payload)}}
 
         print(f'send_observe - request_payload: {request_payload}')
 
+        self.recommend_cache.observed()
+        return self.send_request(request_payload, idempotent=False)
+
+    def send_observe_batch(self, payloads):
+        probability_dict = self.probability_dict
+        request_payload = {"Event": {**self.request_observe_batch_templates["Event"],
+                                     "Requests": [self.build_observation(payload, probability_dict) for payload in payloads]}}
+
+        print(f'send_observe_batch - observations: {len(payloads)}')
+
+        self.recommend_cache.observed(len(payloads))
+        return self.send_request(request_payload, idempotent=False)
+
+    def send_flush(self):
+        request_payload = self.request_flush_templates
+
+        print(f'send_flush - request_payload: {request_payload}')
+
         return self.send_request(request_payload)
 
     def send_recommend(self, payload):
-        request_payload = deepcopy(self.request_recommend_templates)
-        request_payload["Event"]["Request"]["bytes"] = payload["payload_size"]
+        recommendation = self.recommend_cache.get(payload["payload_size"])
+        if recommendation is not None:
+            print(f'send_recommend - cached: {recommendation}; {self.recommend_cache.summary()}')
+            return recommendation
+
+        request_payload = {"Event": {**self.request_recommend_templates["Event"], "Request": {"bytes": payload["payload_size"]}}}
 
         print(f'send_recommend - request_payload: {request_payload}')
 
         recommendation_response = self.send_request(request_payload)
         print(f'send_recommend - response: {recommendation_response}')
+        self.recommend_cache.put(payload["payload_size"], recommendation_response['result'])
         return recommendation_response['result']
@@ -8,7 +8,7 @@ from multiprocessing import Process
 import requests
 
 from utils.config_utils import get_funk_names, get_config
-from utils.lambda_utils import get_rest_api, construct_api_url, get_region_name
+from utils.lambda_utils import resolve_api_url
 
 
 class GenLoad(object):
@@ -29,8 +29,7 @@ class GenLoad(object):
         self.duration = duration
         self.funk_params = funk_config['params']
         self.funk_config = funk_config
-        self.api = get_rest_api(funk_config['api_name'])
-        self.api_url = construct_api_url(self.api['id'], get_region_name(), funk_config['api_stage'], funk_config['api_base_path'])
+        self.api_url = resolve_api_url(funk_config['api_name'], funk_config['api_stage'], funk_config['api_base_path'])
         self.funk_module = import_module(funk_config['module'])
         self.mode = mode
 
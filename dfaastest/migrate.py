@@ -0,0 +1,83 @@
+import argparse
+import os
+import re
+
+from utils.config_utils import get_config
+from utils.database import DB
+
+migrations_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sql', 'migrations')
+
+
+def migration_files(path=migrations_path):
+    """
+    (version, file path) of the migrations, in the order they apply: <version>_<description>.sql
+    """
+    migrations = []
+    for file_name in os.listdir(path):
+        match = re.fullmatch(r'(\d+)_\w+\.sql', file_name)
+        if match:
+            migrations.append((match.group(1), os.path.join(path, file_name)))
+    return sorted(migrations, key=lambda migration: int(migration[0]))
+
+
+class Migrator(object):
+    """
+    applies the pending migrations of sql/migrations, each in its own transaction, and records them in
+    schema_migrations
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.db.execute('''
+            create table if not exists schema_migrations (
+                version VARCHAR(64) primary key,
+                applied_date TIMESTAMP default localtimestamp
+            )
+        ''')
+
+    def applied(self):
+        return {row[0] for row in self.db.query('select version from schema_migrations', ())}
+
+    def pending(self, target=None):
+        applied = self.applied()
+        return [(version, path) for version, path in migration_files()
+                if version not in applied and (target is None or int(version) <= int(target))]
+
+    def migrate(self, target=None):
+        for version, path in self.pending(target):
+            with open(path) as migration_file:
+                migration = migration_file.read()
+
+            print(f"Migrator.migrate - applying {os.path.basename(path)}")
+            with self.db.transaction():
+                self.db.execute(migration)
+                self.db.execute('insert into schema_migrations (version) values (%s)', (version,))
+
+    def create_partitions(self, months):
+        # the monthly partitions of logs_processor_data up to `months` months ahead, see 003_partition_by_created_date.
+        # the records of a new month that landed in the default partition are moved to it (005)
+        self.db.execute("select create_logs_processor_data_partitions(localtimestamp, localtimestamp + %s * interval '1 month')", (months,))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Migrate the dfaastest database schema.')
+    parser.add_argument('--action', default='migrate', choices=['migrate', 'status', 'partitions'],
+                        help='migrate: apply the pending migrations, status: list them, partitions: create the next months\' partitions (run monthly)')
+    parser.add_argument('--target', help='Only apply the migrations up to this version')
+    parser.add_argument('--months', type=int, default=3, help='Months of partitions to create ahead')
+
+    args = parser.parse_args()
+
+    db_config = get_config()['database']
+    migrator = Migrator(DB(host=db_config['host'], user=db_config['user'], password=db_config['pass'], db=db_config['db_name']))
+
+    match args.action:
+        case 'migrate':
+            migrator.migrate(args.target)
+        case 'status':
+            applied = migrator.applied()
+            for version, path in migration_files():
+                print(f"{'applied' if version in applied else 'pending'}  {os.path.basename(path)}")
+        case 'partitions':
+            migrator.create_partitions(args.months)
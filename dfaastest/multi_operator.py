@@ -0,0 +1,153 @@
+import argparse
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from psycopg2.pool import ThreadedConnectionPool
+
+from utils.config_utils import get_config, get_funk_names
+from utils.database import DB, PooledDB
+from utils.embedded_agent import EmbeddedAgent
+from utils.http_utils import HttpTransport
+from worker import DfaastestOperator
+
+
+class MultiFunctionOperator(object):
+    """
+    one process operating many functions: a DfaastestOperator per function, scheduled on a thread pool. All the
+    operators share a pool of DB connections (one per thread) and the HTTP session to the cmab agent (or the embedded
+    agent).
+
+    each function has at most one batch in flight, so a slow function (slow agent requests, a long Lambda memory
+    update) only holds its own thread while the other functions keep being processed on the others, and an error
+    in a function's batch is logged and retried after wait_period without stopping the others.
+    a function is processed again right away after a batch, after wait_period after finding no records, or, with
+    push ingestion, as soon as its records are notified.
+    """
+
+    def __init__(self, config, dryrun, funk_names, experiment_id):
+        self.config = config
+        self.dryrun = dryrun
+        self.wait_period = config['operator']['wait_period']
+        self.ingest = config['operator'].get('ingest', 'poll')
+        self.push_debounce = config['operator'].get('push_debounce', 0)
+
+        multi_config = config['operator'].get('multi') or {}
+        self.max_workers = multi_config.get('max_workers') or len(funk_names)
+        self.schedule_interval = multi_config.get('schedule_interval', 0.5)  # seconds, check for finished batches
+
+        db_config = config['database']
+        db_params = dict(host=db_config['host'], user=db_config['user'], password=db_config['pass'], db=db_config['db_name'])
+        self.pool = ThreadedConnectionPool(1, self.max_workers + 1, host=db_params['host'], dbname=db_params['db'],
+                                           user=db_params['user'], password=db_params['password'])
+        if config['cmab_agent'].get('mode', 'api') == 'embedded':
+            # one agent (and model cache) for every function, handling the requests of the threads one at a time
+            self.transport = EmbeddedAgent(config['cmab_agent'].get('embedded'))
+        else:
+            # the agent requests of every thread share the keep-alive connections of one session
+            http_config = config['cmab_agent'].get('http') or {}
+            self.transport = HttpTransport({**http_config, 'pool_size': max(http_config.get('pool_size', 10), self.max_workers)})
+
+        # the operators run their batches with the synchronous client on the scheduler's threads
+        config = {**config, 'operator': {**config['operator'], 'client': 'sync'}}
+        self.operators = {
+            funk_name: DfaastestOperator(config, dryrun, funk_name, experiment_id, db=PooledDB(self.pool, **db_params), transport=self.transport)
+            for funk_name in funk_names
+        }
+        self.channels = {operator.notify_channel: funk_name for funk_name, operator in self.operators.items()}
+        self.listener = DB(**db_params) if self.ingest == 'push' else None
+
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='operator')
+        self.due = {funk_name: 0.0 for funk_name in self.operators}  # monotonic time the function is polled next
+        self.running = {}  # funk_name: future of its batch in flight
+
+    def schedule(self):
+        now = time.monotonic()
+        for funk_name, operator in self.operators.items():
+            if funk_name not in self.running and self.due[funk_name] <= now:
+                self.running[funk_name] = self.executor.submit(operator.process_batch)
+
+    def collect(self, finished):
+        now = time.monotonic()
+        for funk_name, future in list(self.running.items()):
+            if future not in finished:
+                continue
+            del self.running[funk_name]
+            try:
+                processed = future.result()
+                self.due[funk_name] = now if processed else now + self.wait_period
+            except Exception as e:
+                print(f"MultiFunctionOperator.collect - {funk_name} failed: {type(e).__name__}: {e}, retrying in {self.wait_period} s")
+                self.due[funk_name] = now + self.wait_period
+
+    def next_timeout(self):
+        idle = [due for funk_name, due in self.due.items() if funk_name not in self.running]
+        timeout = max(0.0, min(idle) - time.monotonic()) if idle else self.wait_period
+        return min(timeout, self.schedule_interval) if self.running else timeout
+
+    def wait(self):
+        """
+        until a batch finished, a function is due, or (push) records of a function were notified.
+        returns the finished batches
+        """
+        timeout = self.next_timeout()
+
+        if self.listener is not None:
+            notifies = self.listener.wait_for_notify(list(self.channels), timeout, self.push_debounce)
+            if notifies is None:
+                # (re)connected, records may have been missed: poll every function
+                self.due = {funk_name: 0.0 for funk_name in self.due}
+            else:
+                for notify in notifies:
+                    self.due[self.channels[notify.channel]] = 0.0
+        elif self.running:
+            wait(self.running.values(), timeout=timeout, return_when=FIRST_COMPLETED)
+        else:
+            time.sleep(timeout)
+
+        return {future for future in self.running.values() if future.done()}
+
+    def run(self):
+        print(f"MultiFunctionOperator running {len(self.operators)} functions on {self.max_workers} threads...")
+
+        try:
+            while True:
+                self.schedule()
+
+                if self.dryrun:
+                    # every function once
+                    self.collect(wait(self.running.values()).done)
+                    break
+
+                self.collect(self.wait())
+        finally:
+            try:
+                self.executor.shutdown(wait=True)
+                for funk_name, operator in self.operators.items():
+                    print(f"MultiFunctionOperator.run - {funk_name} memory updates: {operator.reconfiguration.summary()}")
+                    # persist observations the agent may still hold in memory (write-behind checkpointing), a function
+                    # failing to flush does not keep the others from flushing
+                    try:
+                        operator.cmab_client.send_flush()
+                    except Exception as e:
+                        print(f"MultiFunctionOperator.run - {funk_name} flush failed: {type(e).__name__}: {e}")
+                print(f"MultiFunctionOperator.run - agent requests: {self.transport.latency_summary()}")
+            finally:
+                if self.listener is not None and self.listener.listener is not None:
+                    self.listener.listener.close()
+                self.pool.closeall()
+
+
+if __name__ == '__main__':
+
+    funk_names = get_funk_names()
+    config = get_config()
+
+    parser = argparse.ArgumentParser(description='Run the dfaastest operator for many functions in one process.')
+    parser.add_argument('--dryrun', action='store_true', help='Process each function once')
+    parser.add_argument('--funk-names', nargs='+', choices=funk_names, default=funk_names, help='Which functions to operate? (default: every function of funk_generator)')
+    parser.add_argument('--experiment-id', required=True, help='An experiment name or identifier to differentiate between experiment runs.')
+
+    args = parser.parse_args()
+    print(f'args: {args}')
+
+    MultiFunctionOperator(config=config, dryrun=args.dryrun, funk_names=args.funk_names, experiment_id=args.experiment_id).run()
@@ -0,0 +1,209 @@
+import argparse
+import queue
+import threading
+import time
+
+from utils.config_utils import get_config, get_funk_names
+from utils.database import DB
+from worker import DfaastestOperator
+
+
+class StageMetrics(object):
+    """
+    batches processed by a stage, the seconds it waited for them (in its input queue, or for new records for ingest)
+    and worked on them, the seconds it was blocked on a full output queue (backpressure), and the depth of its output
+    queue
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.batches = 0
+        self.errors = 0
+        self.wait_total = self.wait_max = 0.0
+        self.work_total = self.work_max = 0.0
+        self.blocked_total = 0.0
+        self.depth_max = 0
+
+    def processed(self, waited, worked):
+        self.batches += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        self.work_total += worked
+        self.work_max = max(self.work_max, worked)
+
+    def summary(self, output=None):
+        batches = max(self.batches, 1)
+        summary = (f"{self.name}: {self.batches} batches, {self.errors} errors, "
+                   f"waited avg {self.wait_total / batches:.3f} s (max {self.wait_max:.3f} s), "
+                   f"work avg {self.work_total / batches:.3f} s (max {self.work_max:.3f} s), "
+                   f"blocked {self.blocked_total:.3f} s")
+        if output is not None:
+            summary += f", queue depth {output.qsize()}/{output.maxsize} (max {self.depth_max})"
+        return summary
+
+
+class PipelinedOperator(object):
+    """
+    DfaastestOperator with its steps as stages on their own threads, connected by bounded queues, so that a slow
+    Lambda configuration update does not hold up the ingestion of the next records:
+     - ingest: claim a batch, observe it and mark it processed, in one transaction
+     - recommend: ask the agent for a recommendation
+     - reconfigure: apply the recommended memory, subject to the reconfiguration policy, and record the recommendation
+
+    the recommendation travels with its batch to the reconfigure stage, which takes its probabilities for the next
+    observations only once its memory is the function's (see DfaastestOperator.log_recommendation): the observations
+    of the ingest stage carry the probabilities of the memory the function runs at, however far behind the other
+    stages are. The stages share the operator's client, whose recommendation cache is thread safe.
+
+    when a queue is full the stage feeding it blocks, so ingestion never runs more than queue_size batches ahead of
+    each of the next stages. As in DfaastestOperator.process_batch, the records are committed as processed before
+    their recommendation is recorded; a failure in a later stage loses that batch's recommendation, not its records'
+    observations.
+    """
+
+    def __init__(self, config, dryrun, funk_name, experiment_id):
+        self.config = config
+        self.dryrun = dryrun
+
+        pipeline_config = config['operator'].get('pipeline') or {}
+        self.queue_size = pipeline_config.get('queue_size', 2)  # batches waiting between two stages
+        self.metrics_interval = pipeline_config.get('metrics_interval', 60)  # seconds between metrics logs
+
+        # the stages call the agent from their own threads with the synchronous client
+        config = {**config, 'operator': {**config['operator'], 'client': 'sync'}}
+        self.operator = DfaastestOperator(config, dryrun, funk_name, experiment_id)
+        # the ingest stage's transactions are on the operator's connection, the reconfigure stage writes on its own
+        db_config = config['database']
+        self.reconfigure_db = DB(host=db_config['host'], user=db_config['user'], password=db_config['pass'], db=db_config['db_name'])
+
+        self.recommend_queue = queue.Queue(maxsize=self.queue_size)
+        self.reconfigure_queue = queue.Queue(maxsize=self.queue_size)
+        self.stopping = threading.Event()
+        self.metrics = {name: StageMetrics(name) for name in ('ingest', 'recommend', 'reconfigure')}
+
+    def put(self, output, item, metrics):
+        """
+        blocks while the output queue is full: the next stage always drains its queue, until the end of the pipeline
+        """
+        start = time.monotonic()
+        output.put(item)
+        metrics.blocked_total += time.monotonic() - start
+        metrics.depth_max = max(metrics.depth_max, output.qsize())
+
+    def ingest(self):
+        metrics, operator = self.metrics['ingest'], self.operator
+        idle_since = time.monotonic()
+
+        while not self.stopping.is_set():
+            start = time.monotonic()
+            try:
+                with operator.db.transaction():
+                    if operator.lease_seconds:
+                        operator.db.lease(operator.lease_seconds)
+
+                    records = operator.get_data()
+
+                    if records:
+                        operator.cmab_client.send_observe_batch(payloads=[record[2] for record in records]) # 2 is the payload
+                        operator.db.update_records_status([record[0] for record in records], 'P', operator.experiment_id)
+                        payload_size = operator.get_recommend_payload_size(records)
+            except Exception as e:
+                # rolled back, the records are claimed again on the next attempt
+                print(f"PipelinedOperator.ingest - failed: {type(e).__name__}: {e}, retrying in {operator.wait_period} s")
+                metrics.errors += 1
+                self.stopping.wait(operator.wait_period)
+                continue
+
+            if records:
+                metrics.processed(start - idle_since, time.monotonic() - start)
+                self.put(self.recommend_queue, (records, payload_size, time.monotonic()), metrics)
+                idle_since = time.monotonic()
+            elif not self.dryrun:
+                operator.wait_for_records()
+
+            if self.dryrun:
+                break
+
+        self.put(self.recommend_queue, None, metrics)
+
+    def recommend(self):
+        metrics, operator = self.metrics['recommend'], self.operator
+
+        while (item := self.recommend_queue.get()) is not None:
+            records, payload_size, queued = item
+            start = time.monotonic()
+            try:
+                recommendation = operator.cmab_client.send_recommend(payload={"payload_size": payload_size})
+                print(f"getting recommendation from cmab agent: {recommendation['recommended_memory']}")
+            except Exception as e:
+                print(f"PipelinedOperator.recommend - failed: {type(e).__name__}: {e}, the batch of {len(records)} records is not recommended for")
+                metrics.errors += 1
+                continue
+
+            metrics.processed(start - queued, time.monotonic() - start)
+            self.put(self.reconfigure_queue, (records, payload_size, recommendation, time.monotonic()), metrics)
+
+        self.put(self.reconfigure_queue, None, metrics)
+
+    def reconfigure(self):
+        metrics, operator = self.metrics['reconfigure'], self.operator
+
+        while (item := self.reconfigure_queue.get()) is not None:
+            records, payload_size, recommendation, queued = item
+            start = time.monotonic()
+            try:
+                skipped = operator.reconfigure(records, recommendation)
+                operator.log_recommendation(records, payload_size, recommendation, db=self.reconfigure_db,
+                                            deployed=skipped in (None, 'noop'))
+            except Exception as e:
+                print(f"PipelinedOperator.reconfigure - failed: {type(e).__name__}: {e}")
+                metrics.errors += 1
+                continue
+
+            metrics.processed(start - queued, time.monotonic() - start)
+            operator.record_latency(records)
+
+    def summary(self):
+        return '\n'.join([
+            self.metrics['ingest'].summary(self.recommend_queue),
+            self.metrics['recommend'].summary(self.reconfigure_queue),
+            self.metrics['reconfigure'].summary(),
+        ])
+
+    def run(self):
+        print(f"PipelinedOperator running (queue size {self.queue_size})...")
+
+        stages = [threading.Thread(target=stage, name=f"pipeline-{stage.__name__}", daemon=True)
+                  for stage in (self.ingest, self.recommend, self.reconfigure)]
+        for stage in stages:
+            stage.start()
+
+        try:
+            # until the last stage drained the pipeline (dryrun) or the process is killed
+            while stages[-1].is_alive():
+                stages[-1].join(timeout=self.metrics_interval)
+                print(f"PipelinedOperator.run - stage metrics:\n{self.summary()}")
+        finally:
+            # ingestion stops, the other stages finish the batches already ingested
+            self.stopping.set()
+            for stage in stages:
+                stage.join()
+            # persist observations the agent may still hold in memory (write-behind checkpointing)
+            self.operator.cmab_client.send_flush()
+            print(f"PipelinedOperator.run - memory updates: {self.operator.reconfiguration.summary()}\n{self.summary()}")
+
+
+if __name__ == '__main__':
+
+    funk_names = get_funk_names()
+    config = get_config()
+
+    parser = argparse.ArgumentParser(description='Run the dfaastest operator for a function with ingestion, recommendation and reconfiguration as pipelined stages.')
+    parser.add_argument('--dryrun', action='store_true', help='Process one batch through the pipeline')
+    parser.add_argument('--funk-name', required=True, choices=funk_names, help='Which function to operate?')
+    parser.add_argument('--experiment-id', required=True, help='An experiment name or identifier to differentiate between experiment runs.')
+
+    args = parser.parse_args()
+    print(f'args: {args}')
+
+    PipelinedOperator(config=config, dryrun=args.dryrun, funk_name=args.funk_name, experiment_id=args.experiment_id).run()
@@ -1,18 +1,158 @@
+import itertools
+
 import psycopg2
+import psycopg2.sql
+from contextlib import contextmanager
 from datetime import datetime
 import json
+import select
+import threading
+import time
+
+# the columns of logs_processor_data the workers read, in the table's order, and only the fields of the payload they use
+record_columns = '''
+    request_id, function_name,
+    jsonb_build_object('memory_size', payload->'memory_size', 'billed_duration', payload->'billed_duration',
+                       'payload_size', payload->'payload_size') as payload,
+    created_date, status
+'''
 
 
 class DB(object):
 
     def __init__(self, **params):
-        self.postgres = psycopg2.connect(host=params['host'], dbname=params['db'], user=params['user'], password=params['password'])
+        self.params = params
+        self.postgres = self.connect()
+        self.listener = None  # autocommit connection receiving notifications, see wait_for_notify
+        self.in_transaction = False
+        self.cursor_ids = itertools.count()
+
+    def connect(self):
+        return psycopg2.connect(host=self.params['host'], dbname=self.params['db'], user=self.params['user'], password=self.params['password'])
+
+    @contextmanager
+    def transaction(self):
+        """
+        the writes within the block are committed once at its end, or rolled back together on an error
+        """
+        self.in_transaction = True
+        try:
+            yield self
+            self.postgres.commit()
+        except Exception:
+            if self.postgres.closed:
+                # e.g. the session was ended when its lease expired, the server rolled the transaction back
+                self.reset()
+            else:
+                self.postgres.rollback()
+            raise
+        finally:
+            self.in_transaction = False
+
+    def reset(self):
+        self.postgres = self.connect()
+
+    def lease(self, seconds):
+        """
+        within transaction(): the session is ended if the transaction waits for more than seconds between two
+        statements (e.g. a hung worker), which rolls it back and releases the records it claimed
+        """
+        self.execute("select set_config('idle_in_transaction_session_timeout', %s, true)", (str(int(seconds * 1000)),))
+
+    def claim_records(self, function_name, limit, fetch_size=1000):
+        """
+        the `limit` oldest unprocessed records of the function, locked until the end of the transaction. Records
+        locked by the transaction of another worker are skipped, so that concurrent workers split the backlog instead
+        of processing the same records twice. The batch is read fetch_size records per round trip.
+        """
+        return list(self.stream(
+            f'''
+            select {record_columns}
+              from logs_processor_data
+             where status is null
+               and function_name = %s
+             order by created_date
+             limit %s
+               for update skip locked
+            ''',
+            (function_name, limit),
+            fetch_size
+        ))
+
+    def stream(self, sql, params, fetch_size=1000):
+        """
+        the rows of the query, fetched fetch_size at a time from a server side cursor instead of all at once.
+        the cursor lives in the current transaction, consume the rows before it ends
+        """
+        with self.postgres.cursor(name=f'stream_{next(self.cursor_ids)}') as cursor:
+            cursor.itersize = fetch_size
+            cursor.execute(sql, params)
+            yield from cursor
+
+    def commit(self):
+        # within transaction(), the block commits
+        if not self.in_transaction:
+            self.postgres.commit()
+
+    def clock_offset(self):
+        """
+        local time minus the database's local time, to compare timestamps set by the database with the local clock
+        """
+        before = datetime.now()
+        db_time = self.query('select localtimestamp', ())[0][0]
+        after = datetime.now()
+        self.commit()  # do not leave the connection idle in the query's transaction
+        return before + (after - before) / 2 - db_time
+
+    def listen(self, channels):
+        self.listener = self.connect()
+        self.listener.autocommit = True
+        with self.listener.cursor() as cursor:
+            for channel in channels:
+                cursor.execute(psycopg2.sql.SQL('LISTEN {}').format(psycopg2.sql.Identifier(channel)))
+
+    def wait_for_notify(self, channels, timeout, debounce=0):
+        """
+        block until a notification arrives on one of the channels, or for timeout seconds. Returns the notifications
+        received, empty after a timeout. Notifications arriving within debounce seconds of the first one are returned
+        with it.
+
+        returns None when the notifications sent meanwhile may have been missed: after (re)connecting the listener,
+        immediately, or after timeout seconds if the database can not be reached. The caller should then poll.
+        """
+        try:
+            if self.listener is None or self.listener.closed:
+                self.listen(channels)
+                return None
+
+            if select.select([self.listener], [], [], timeout) != ([], [], []):
+                self.listener.poll()
+                if debounce:
+                    time.sleep(debounce)
+                    self.listener.poll()
+
+            notifies = list(self.listener.notifies)
+            self.listener.notifies.clear()
+            return notifies
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            print(f"DB.wait_for_notify - lost the listener connection: {e}, polling until it is back")
+            if self.listener is not None:
+                self.listener.close()
+            self.listener = None
+            time.sleep(timeout)
+            return None
 
     def query(self, sql, params):
         with self.postgres.cursor() as cursor:
             cursor.execute(sql, params)
             return cursor.fetchall()
 
+    def execute(self, sql, params=None):
+        with self.postgres.cursor() as cursor:
+            cursor.execute(sql, params)
+
+            self.commit()
+
     def insert(self, data):
         with self.postgres.cursor() as cursor:
             request_id = data["request_id"]
@@ -25,16 +165,22 @@ class DB(object):
 
             cursor.execute(sql, (request_id, payload))
 
-            self.postgres.commit()
+            self.commit()
 
     def update_record_status(self, request_id, status, experiment_id):
+        self.update_records_status([request_id], status, experiment_id)
+
+    def update_records_status(self, request_ids, status, experiment_id):
+        """
+        set the status and experiment of a batch of records in one statement
+        """
         with self.postgres.cursor() as cursor:
             cursor.execute(
-                'UPDATE logs_processor_data SET status = %s, experiment_id = %s WHERE request_id = %s',
-                (status, experiment_id, request_id)
+                'UPDATE logs_processor_data SET status = %s, experiment_id = %s WHERE request_id = ANY(%s)',
+                (status, experiment_id, list(request_ids))
             )
 
-            self.postgres.commit()
+            self.commit()
 
     def insert_recommendation_probability(self, function_name, experiment_id, probability,
                                           num_of_records_observed, payload_size, recommended_size, current_memory):
@@ -51,4 +197,27 @@ class DB(object):
                  datetime.today().strftime('%F %T.%f')[:-3], payload_size, recommended_size, current_memory)
             )
 
-            self.postgres.commit()
\ No newline at end of file
+            self.commit()
+
+
+class PooledDB(DB):
+    """
+    DB sharing the connections of a psycopg2 ThreadedConnectionPool with other DB objects. Statements run on the
+    connection of the calling thread, taken from the pool on its first statement and kept, so the pool needs as many
+    connections as there are threads. A transaction() has to stay on one thread.
+    """
+
+    def __init__(self, pool, **params):
+        self.params = params  # for the listener connection, see wait_for_notify
+        self.pool = pool
+        self.listener = None
+        self.in_transaction = False
+        self.cursor_ids = itertools.count()
+
+    @property
+    def postgres(self):
+        return self.pool.getconn(key=threading.get_ident())
+
+    def reset(self):
+        # the thread takes a new connection from the pool on its next statement
+        self.pool.putconn(self.postgres, key=threading.get_ident(), close=True)
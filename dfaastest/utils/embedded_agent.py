@@ -0,0 +1,98 @@
+import importlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+repo_path = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+# the agent's modules import each other as top level modules, the way Lambda loads them
+cmab_agent_path = os.path.join(repo_path, 'cmab_agent')
+
+# lambda_function keeps its model store, working directory and model cache at module level: they are set up once per
+# process and shared by every EmbeddedAgent, whose requests are handled one at a time under this lock
+agent_lock = threading.Lock()
+agent_setup = None  # (model_dir, per_bucket, model_path) the agent was set up with
+
+
+class EmbeddedResponse(object):
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return {"statusCode": 200, "body": self.body}
+
+
+class EmbeddedAgent(object):
+    """
+    runs the CMAB agent in the client's process: requests are handed to lambda_function.lambda_handler instead of being
+    POSTed to API Gateway, and the models are persisted to a local directory instead of S3 (models/, untracked, flat
+    like s3_backup/, by default). Same interface as HttpTransport, so CmabClient serializes the requests and reads the responses the same
+    way in both modes. Models stay resident between requests, the checkpoint policy of the requests decides when
+    they are written to the directory (send_flush writes everything observed).
+
+    the agent's model cache is not thread safe and is shared by the EmbeddedAgents of the process, their requests are
+    handled one at a time. A relative model_dir is relative to the repository.
+    """
+
+    def __init__(self, embedded_config=None):
+        embedded_config = embedded_config or {}
+
+        if cmab_agent_path not in sys.path:
+            sys.path.insert(0, cmab_agent_path)
+        # imported here so that the agent's dependencies are only needed in embedded mode
+        self.lambda_function = importlib.import_module('lambda_function')
+        model_store = importlib.import_module('model_store')
+
+        global agent_setup
+        model_dir = os.path.join(repo_path, embedded_config.get('model_dir', 'models'))
+        per_bucket = embedded_config.get('per_bucket', False)
+        with agent_lock:
+            if agent_setup is None:
+                os.makedirs(model_dir, exist_ok=True)
+                self.lambda_function.model_store = model_store.LocalModelStore(model_dir, per_bucket=per_bucket)
+                self.lambda_function.local_model_path = embedded_config.get('model_path') or tempfile.mkdtemp()
+                self.lambda_function.verbose = False
+                agent_setup = (model_dir, per_bucket, self.lambda_function.local_model_path)
+            elif agent_setup[:2] != (model_dir, per_bucket):
+                raise ValueError(f"the embedded agent of this process persists its models to {agent_setup[0]} "
+                                 f"(per_bucket: {agent_setup[1]}), not {model_dir} (per_bucket: {per_bucket})")
+
+        self.metrics = {'calls': 0, 'latency_total': 0.0, 'latency_max': 0.0, 'latency_last': 0.0}
+        print(f"EmbeddedAgent - models persisted to {model_dir}")
+
+    def create_model_if_missing(self, event):
+        """
+        store an untrained model for a new experiment, the agent expects the model of the requests' S3 key to exist.
+        event: the Event template of the client's requests
+        """
+        bucket, key = event['S3']['bucket'], event['S3']['key']
+        model_store = self.lambda_function.get_store()
+        with agent_lock:
+            if os.path.exists(model_store.path(bucket, key)):
+                return
+            agent = self.lambda_function.new_agent(event['config'])
+            agent.save_model_state()
+            with open(os.path.join(self.lambda_function.local_model_path, key), 'rb') as model_file:
+                model_store.put(bucket, key, model_file.read())
+            print(f"EmbeddedAgent - created the model {model_store.path(bucket, key)}")
+
+    def post(self, url, data, idempotent=True):
+        start = time.perf_counter()
+        with agent_lock:
+            body = self.lambda_function.lambda_handler({"body": data}, None)
+
+        latency = time.perf_counter() - start
+        self.metrics['calls'] += 1
+        self.metrics['latency_total'] += latency
+        self.metrics['latency_max'] = max(self.metrics['latency_max'], latency)
+        self.metrics['latency_last'] = latency
+
+        return EmbeddedResponse(body)
+
+    def latency_summary(self):
+        calls = self.metrics['calls']
+        average = self.metrics['latency_total'] / calls if calls else 0.0
+        return (f"calls: {calls}, latency avg: {average * 1000:.1f} ms, max: {self.metrics['latency_max'] * 1000:.1f} ms, "
+                f"last: {self.metrics['latency_last'] * 1000:.1f} ms")
@@ -0,0 +1,88 @@
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+
+class HttpTransport(object):
+    """
+    POSTs JSON bodies over a shared keep-alive session (pooled connections), with bounded timeouts and retries with
+    jittered exponential backoff on throttling / server errors and connection failures.
+    a request that is not idempotent (an observe: the agent would learn it twice) is only retried when it cannot have
+    reached the agent: throttled (429) or the connection could not be established.
+    keeps per-call latency metrics.
+    """
+
+    def __init__(self, http_config=None):
+        http_config = http_config or {}
+        self.timeout = (http_config.get('connect_timeout', 3.05), http_config.get('read_timeout', 30))
+        self.retries = http_config.get('retries', 3)
+        self.backoff = http_config.get('backoff', 0.5)  # seconds, doubled after every attempt
+        self.max_backoff = http_config.get('max_backoff', 10)
+        self.retry_statuses = set(http_config.get('retry_statuses', [429, 500, 502, 503, 504]))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=http_config.get('pool_size', 10))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.metrics = {'calls': 0, 'retries': 0, 'errors': 0, 'latency_total': 0.0, 'latency_max': 0.0,
+                        'latency_last': 0.0}
+
+    def sleep_before_retry(self, attempt):
+        # "full jitter": a random wait up to the exponential backoff, so that throttled clients do not retry in step
+        time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    @staticmethod
+    def never_sent(error):
+        """
+        whether the request failed before reaching the server: the connection could not be established
+        """
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+    def post(self, url, data, idempotent=True):
+        """
+        POST data (a serialized JSON string) and return the response, retrying as configured.
+        raises the last error when every attempt failed.
+        """
+        start = time.perf_counter()
+        retry_statuses = self.retry_statuses if idempotent else self.retry_statuses & {429}
+
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(url, data=data, timeout=self.timeout)
+                if response.status_code not in retry_statuses or attempt == self.retries:
+                    response.raise_for_status()
+                    break
+                print(f"HttpTransport.post - {url} answered {response.status_code}, retrying (attempt {attempt + 1})")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries or not (idempotent or self.never_sent(e)):
+                    self.metrics['errors'] += 1
+                    raise
+                print(f"HttpTransport.post - {url} failed: {e}, retrying (attempt {attempt + 1})")
+            except requests.HTTPError:
+                self.metrics['errors'] += 1
+                raise
+
+            self.metrics['retries'] += 1
+            self.sleep_before_retry(attempt)
+
+        latency = time.perf_counter() - start
+        self.metrics['calls'] += 1
+        self.metrics['latency_total'] += latency
+        self.metrics['latency_max'] = max(self.metrics['latency_max'], latency)
+        self.metrics['latency_last'] = latency
+
+        return response
+
+    def latency_summary(self):
+        calls = self.metrics['calls']
+        average = self.metrics['latency_total'] / calls if calls else 0.0
+        return (f"calls: {calls}, retries: {self.metrics['retries']}, errors: {self.metrics['errors']}, "
+                f"latency avg: {average * 1000:.1f} ms, max: {self.metrics['latency_max'] * 1000:.1f} ms, "
+                f"last: {self.metrics['latency_last'] * 1000:.1f} ms")
@@ -66,6 +66,7 @@ def create(lambda_config):
         api_id = create_rest_api(
             apig_client, api_name, api_base_path, api_stage, account_id,
             lambda_client, lambda_function_arn)
+        invalidate_api_url(api_name, api_stage, api_base_path)  # a URL cached for a deleted API of the same name
     else:
         api_id = existing_rest_api['id']
 
@@ -77,8 +78,8 @@ def create(lambda_config):
 
 
 def get_region_name():
-    apig_client = boto3.client('apigateway')
-    return apig_client.meta.region_name
+    # the region of the default session, without creating a client just to read it
+    return boto3.session.Session().region_name
 
 
 def create_rest_api(
@@ -186,28 +187,86 @@ def create_rest_api(
 
 
 def get_rest_api(rest_api_name):
+    """
+    finds the REST API (or else the HTTP API) named rest_api_name, page by page, stopping at the first match.
+
+    :return: {'id': <api id>, ...} or None
+    """
     apig_client = boto3.client('apigateway')
+    for page in apig_client.get_paginator('get_rest_apis').paginate():
+        for api in page['items']:
+            if api['name'] == rest_api_name:
+                return api
+
+    apig_client = boto3.client('apigatewayv2')
+    for page in apig_client.get_paginator('get_apis').paginate():
+        for http_api in page['Items']:
+            if http_api['Name'] == rest_api_name:
+                return { 'id': http_api['ApiId'] }
 
-    rest_apis = apig_client.get_rest_apis()['items']
+    return None
 
-    for api in rest_apis :
-        #print(f"api['name']: {api['name']}")
 
-        if api['name'] == rest_api_name:
-            return api
+# resolved API URLs, shared by every process on the host: {"<region>/<api_name>/<stage>/<base_path>": {"url", "resolved_at"}}
+api_cache_path = os.environ.get('DFAASTEST_API_CACHE', os.path.join(os.path.dirname(__file__), '..', '.api_cache.json'))
+api_cache_ttl = float(os.environ.get('DFAASTEST_API_CACHE_TTL', 24 * 3600))  # seconds
 
-    apig_client = boto3.client('apigatewayv2')
 
-    http_apis = apig_client.get_apis()['Items']
-    print(f"http_apis: {http_apis}")
+def read_api_cache():
+    try:
+        with open(api_cache_path) as cache_file:
+            return json.load(cache_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
 
-    for http_api in http_apis :
-        print(f"http_api['Name']: {http_api['Name']}")
+def write_api_cache(api_cache):
+    # write and rename, readers never see a partially written file
+    temp_path = f"{api_cache_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as cache_file:
+        json.dump(api_cache, cache_file, indent=2)
+    os.replace(temp_path, api_cache_path)
 
-        if http_api['Name'] == rest_api_name:
-            return { 'id': http_api['ApiId'] }
 
-    return None
+def api_cache_key(region, api_name, api_stage, api_base_path):
+    return f"{region}/{api_name}/{api_stage}/{api_base_path}"
+
+
+def resolve_api_url(api_name, api_stage, api_base_path, refresh=False):
+    """
+    URL of the API from the on-disk cache when it was resolved less than api_cache_ttl seconds ago, looked up in
+    API Gateway (and cached) otherwise or when refresh is set.
+    """
+    region = get_region_name()
+    key = api_cache_key(region, api_name, api_stage, api_base_path)
+
+    api_cache = read_api_cache()
+    entry = api_cache.get(key)
+    if not refresh and entry and time.time() - entry['resolved_at'] < api_cache_ttl:
+        return entry['url']
+
+    api = get_rest_api(api_name)
+    if api is None:
+        raise LookupError(f"resolve_api_url - no REST or HTTP API named {api_name} in {region}")
+
+    url = construct_api_url(api['id'], region, api_stage, api_base_path)
+    api_cache = read_api_cache()  # other processes may have resolved other APIs meanwhile
+    api_cache[key] = {'url': url, 'resolved_at': time.time()}
+    write_api_cache(api_cache)
+    return url
+
+
+def invalidate_api_url(api_name=None, api_stage=None, api_base_path=None):
+    """
+    drops the cached URL of the API, or every cached URL without api_name
+    """
+    if api_name is None:
+        write_api_cache({})
+        return
+
+    api_cache = read_api_cache()
+    api_cache.pop(api_cache_key(get_region_name(), api_name, api_stage, api_base_path), None)
+    write_api_cache(api_cache)
 
 
 def construct_api_url(api_id, region, api_stage, api_base_path):
@@ -0,0 +1,109 @@
+import bisect
+import math
+import random
+import threading
+import time
+
+
+class RecommendationCache(object):
+    """
+    client side cache of the agent's recommendations, keyed by the payload size context quantized into buckets:
+    explicit bucket_edges (upper bounds), or geometric buckets growing by bucket_ratio.
+
+    an entry is reused until it is ttl seconds old or max_observations observations were sent since it was stored,
+    whichever comes first (0 disables either limit). On a hit the memory is sampled locally from the cached
+    probability_list, so the recommendation keeps exploring and the logged probability is the one it was drawn with.
+    get, put and observed can be called from different threads (see pipelined_operator.py).
+    """
+
+    def __init__(self, cache_config=None, mem_list=None, seed=None):
+        cache_config = cache_config or {}
+        self.enabled = cache_config.get('enabled', False)
+        self.ttl = cache_config.get('ttl', 60)  # seconds
+        self.max_observations = cache_config.get('max_observations', 100)
+        self.bucket_edges = sorted(cache_config.get('bucket_edges') or [])
+        self.bucket_ratio = cache_config.get('bucket_ratio', 2)
+
+        self.mem_list = mem_list
+        self.rng = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.observations = 0  # observations sent for the function so far
+        self.metrics = {'hits': 0, 'misses': 0, 'expired_ttl': 0, 'expired_observations': 0,
+                        'staleness_seconds_total': 0.0, 'staleness_seconds_max': 0.0,
+                        'staleness_observations_total': 0, 'staleness_observations_max': 0}
+
+    def bucket(self, payload_size):
+        if self.bucket_edges:
+            return bisect.bisect_left(self.bucket_edges, payload_size)
+        if payload_size <= 1:
+            return 0
+        return math.floor(math.log(payload_size, self.bucket_ratio))
+
+    def observed(self, n=1):
+        with self.lock:
+            self.observations += n
+
+    def expired(self, age, observations):
+        if self.ttl and age >= self.ttl:
+            self.metrics['expired_ttl'] += 1
+            return True
+        if self.max_observations and observations >= self.max_observations:
+            self.metrics['expired_observations'] += 1
+            return True
+        return False
+
+    def get(self, payload_size):
+        """
+        a recommendation sampled from the cached probability list of the payload size's bucket, or None
+        """
+        if not self.enabled:
+            return None
+
+        with self.lock:
+            bucket = self.bucket(payload_size)
+            entry = self.entries.get(bucket)
+            if entry is not None:
+                age = time.monotonic() - entry['time']
+                observations = self.observations - entry['observations']
+                if self.expired(age, observations):
+                    del self.entries[bucket]
+                    entry = None
+
+            if entry is None:
+                self.metrics['misses'] += 1
+                return None
+
+            self.metrics['hits'] += 1
+            self.metrics['staleness_seconds_total'] += age
+            self.metrics['staleness_seconds_max'] = max(self.metrics['staleness_seconds_max'], age)
+            self.metrics['staleness_observations_total'] += observations
+            self.metrics['staleness_observations_max'] = max(self.metrics['staleness_observations_max'], observations)
+
+            probability_list = entry['probability_list']
+            index = self.rng.choices(range(len(probability_list)), weights=probability_list)[0]
+            return {
+                "recommended_memory": self.mem_list[index],
+                "action_probability": probability_list[index],
+                "probability_list": probability_list,
+            }
+
+    def put(self, payload_size, recommendation):
+        if self.enabled:
+            with self.lock:
+                self.entries[self.bucket(payload_size)] = {
+                    'probability_list': recommendation['probability_list'],
+                    'time': time.monotonic(),
+                    'observations': self.observations,
+                }
+
+    def summary(self):
+        hits, misses = self.metrics['hits'], self.metrics['misses']
+        hit_rate = hits / (hits + misses) if hits + misses else 0.0
+        average_age = self.metrics['staleness_seconds_total'] / hits if hits else 0.0
+        average_observations = self.metrics['staleness_observations_total'] / hits if hits else 0.0
+        return (f"hits: {hits}, misses: {misses}, hit rate: {hit_rate:.1%}, "
+                f"expired (ttl / observations): {self.metrics['expired_ttl']} / {self.metrics['expired_observations']}, "
+                f"staleness avg: {average_age:.1f} s / {average_observations:.1f} observations, "
+                f"max: {self.metrics['staleness_seconds_max']:.1f} s / {self.metrics['staleness_observations_max']} observations")
@@ -0,0 +1,130 @@
+import math
+import time
+
+
+class ReconfigurationPolicy(object):
+    """
+    decides whether a recommended memory is applied to the function, each change costing a configuration update and
+    cold starts of the function's instances. When enabled, a recommendation is skipped when:
+     - 'noop': it is the function's current memory
+    and, for a greedy recommendation (the most probable memory of the agent's distribution) only:
+     - 'hysteresis': it was not recommended for `hysteresis` consecutive batches yet
+     - 'dwell': the current memory was applied less than `min_dwell` seconds ago
+     - 'cost': the cold starts of the switch cost more than it saves over `horizon` seconds (see payback)
+    an exploratory recommendation (any other memory sampled by the agent) is always applied, or the rarely sampled
+    memories would hardly ever be deployed: at probability p, hysteresis 2 alone deploys them with probability p².
+
+    the cost model compares the average GB-seconds of an invocation at the current and at the recommended memory,
+    learned from the billed duration of the observed records. A memory not observed yet is always worth a switch,
+    the agent has to explore it.
+
+    propensities: the agent weighs each observation by the probability of its memory in the distribution that chose
+    it (importance weighting, also in replay.py). A skipped greedy switch keeps the memory an earlier distribution
+    chose, and its observations keep that distribution's probabilities (see DfaastestOperator.log_recommendation),
+    but the deployed memory no longer follows the logged distribution exactly: hysteresis, dwell and the cost gate
+    bias the agent's estimates. Only the no-op skip is free of bias, the default configuration.
+    """
+
+    def __init__(self, policy_config=None):
+        policy_config = policy_config or {}
+        self.enabled = policy_config.get('enabled', True)
+        self.hysteresis = max(1, policy_config.get('hysteresis', 1))
+        self.min_dwell = policy_config.get('min_dwell', 0)  # seconds
+        cold_start_config = policy_config.get('cold_start') or {}
+        self.cold_start_ms = cold_start_config.get('cost_ms', 0)  # extra billed duration of a cold start, 0 = no cost model
+        self.horizon = cold_start_config.get('horizon', 300)  # seconds a new memory is expected to be kept
+        self.duration_alpha = cold_start_config.get('duration_alpha', 0.1)  # weight of the newest record in the averages
+
+        self.current_memory = None  # the function's memory, from the records until a change is applied
+        self.last_change = None  # monotonic time of the last change applied
+        self.candidate = None  # memory recommended in the last batches, and for how many in a row
+        self.candidate_batches = 0
+        self.durations = {}  # memory: ewma of the billed duration (ms) of its invocations
+        self.rate = None  # invocations per second
+
+        self.metrics = {'applied': 0, 'exploratory': 0, 'noop': 0, 'hysteresis': 0, 'dwell': 0, 'cost': 0}
+
+    def observe(self, records):
+        """
+        the function's current memory, its invocation rate and billed durations from a batch of records, oldest first
+        """
+        for record in records:
+            payload = record[2]  # 2 is the payload
+            if payload.get('billed_duration') is None:
+                continue
+            memory, duration = int(payload['memory_size']), float(payload['billed_duration'])
+            average = self.durations.get(memory)
+            self.durations[memory] = duration if average is None else average + self.duration_alpha * (duration - average)
+
+        if records:
+            if self.last_change is None:
+                self.current_memory = int(records[-1][2]['memory_size'])
+            # 3 is the created_date, a batch within a second counts as a second
+            span = max((records[-1][3] - records[0][3]).total_seconds(), 1.0)
+            self.rate = len(records) / span
+
+    def payback(self, memory):
+        """
+        GB-seconds saved over the horizon by switching from the current memory to memory, less the GB-seconds of the
+        cold starts, one per instance busy at the current rate (Little's law). None when the durations are unknown
+        """
+        current_duration, duration = self.durations.get(self.current_memory), self.durations.get(memory)
+        if current_duration is None or duration is None or self.rate is None:
+            return None
+
+        saved_per_invocation = (self.current_memory * current_duration - memory * duration) / 1024 / 1000
+        instances = max(1, math.ceil(self.rate * duration / 1000))
+        cold_starts_cost = instances * memory * self.cold_start_ms / 1024 / 1000
+        return saved_per_invocation * self.rate * self.horizon - cold_starts_cost
+
+    @staticmethod
+    def exploratory(recommendation):
+        """
+        whether the agent sampled another memory than its most probable one
+        """
+        return recommendation['action_probability'] < max(recommendation['probability_list'])
+
+    def decide(self, recommendation, records):
+        """
+        whether to apply the recommended memory. Returns the reason it is skipped, or None to apply it (then call
+        applied once it is)
+        """
+        self.observe(records)
+        memory = recommendation['recommended_memory']
+
+        if not self.enabled:
+            # every recommendation is applied, like before the policy
+            return None
+
+        if memory == self.current_memory:
+            reason = 'noop'
+            self.candidate, self.candidate_batches = None, 0
+        elif self.exploratory(recommendation):
+            self.metrics['exploratory'] += 1
+            return None
+        else:
+            self.candidate_batches = self.candidate_batches + 1 if memory == self.candidate else 1
+            self.candidate = memory
+            payback = self.payback(memory) if self.cold_start_ms else None
+
+            if self.candidate_batches < self.hysteresis:
+                reason = 'hysteresis'
+            elif self.last_change is not None and time.monotonic() - self.last_change < self.min_dwell:
+                reason = 'dwell'
+            elif payback is not None and payback <= 0:
+                reason = 'cost'
+            else:
+                return None
+
+        self.metrics[reason] += 1
+        return reason
+
+    def applied(self, memory):
+        self.current_memory = memory
+        self.last_change = time.monotonic()
+        self.candidate, self.candidate_batches = None, 0
+        self.metrics['applied'] += 1
+
+    def summary(self):
+        skipped = sum(self.metrics[reason] for reason in ('noop', 'hysteresis', 'dwell', 'cost'))
+        return {**self.metrics, 'skipped': skipped}
@@ -0,0 +1,99 @@
+import math
+import re
+from collections import deque
+
+
+class RollingPayloadStats(object):
+    """
+    running mean of the payload size of the processed records over a window, updated one record at a time:
+     - 'count': the last `size` records, in a ring buffer with a running sum
+     - 'seconds': the records created within `size` seconds of the newest one
+     - 'ewma': exponentially weighted moving average, the newest record weighing `alpha`
+    """
+
+    def __init__(self, window, size=None, alpha=0.1):
+        self.window = window
+        self.size = size
+        self.alpha = alpha
+
+        self.total = 0  # running sum of the payload sizes in the window
+        self.count = 0
+        match window:
+            case 'count':
+                self.ring = [0] * size
+                self.next = 0  # ring slot of the next record
+            case 'seconds':
+                self.records = deque()  # (created_date, payload_size), oldest first
+                self.newest = None
+            case 'ewma':
+                self.average = None
+
+    def add(self, payload_size, created_date=None):
+        match self.window:
+            case 'count':
+                if self.count == self.size:
+                    self.total -= self.ring[self.next]
+                else:
+                    self.count += 1
+                self.ring[self.next] = payload_size
+                self.total += payload_size
+                self.next = (self.next + 1) % self.size
+
+            case 'seconds':
+                self.records.append((created_date, payload_size))
+                self.total += payload_size
+                self.newest = created_date if self.newest is None else max(self.newest, created_date)
+                while (self.newest - self.records[0][0]).total_seconds() > self.size:
+                    self.total -= self.records.popleft()[1]
+                self.count = len(self.records)
+
+            case 'ewma':
+                if self.average is None:
+                    self.average = payload_size
+                else:
+                    self.average += self.alpha * (payload_size - self.average)
+                self.count += 1
+
+    def add_records(self, records):
+        for record in records:
+            self.add(int(record[2]["payload_size"]), record[3])  # 2 is the payload, 3 the created_date
+
+    def mean(self):
+        """
+        mean payload size over the window, None while it is empty
+        """
+        if not self.count:
+            return None
+        if self.window == 'ewma':
+            return self.average
+        return self.total / self.count
+
+    def seed_window(self):
+        """
+        (limit, seconds) of the most recent records that seed the window, None meaning no bound. seconds are counted
+        back from the newest record's created_date, as add trims the window
+        """
+        match self.window:
+            case 'count':
+                return self.size, None
+            case 'seconds':
+                return None, self.size
+            case 'ewma':
+                # older records weigh less than 1% of the average together
+                return math.ceil(math.log(0.01) / math.log(1 - self.alpha)), None
+
+
+def payload_stats_for(algorithm, ewma_alpha=0.1):
+    """
+    the rolling window of a recommend_payload_algorithm: 'last_<n>' (records), 'last_<n>s' (seconds), 'ewma', or None
+    for 'wait_period', which averages each batch on its own
+    """
+    if algorithm == 'wait_period':
+        return None
+    if algorithm == 'ewma':
+        return RollingPayloadStats('ewma', alpha=ewma_alpha)
+
+    match = re.fullmatch(r'last_(\d+)(s?)', algorithm)
+    if not match:
+        raise ValueError(f"unknown recommend_payload_algorithm {algorithm}")
+    return RollingPayloadStats('seconds' if match.group(2) else 'count', size=int(match.group(1)))
@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import json
+import threading
+
+
+class StubAgent(object):
+    """
+    stand-in for the CMAB agent API to measure the client side offline: answers observe, observe_batch, flush and
+    recommend requests like the agent behind API Gateway, after a fixed latency (sleeping, so that concurrent requests
+    overlap the way concurrent Lambda invocations do). The recommendation is always the smallest memory, with uniform
+    probabilities.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8081, latency=0.05, mem_list=(128, 256, 512, 1024, 2048)):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.mem_list = list(mem_list)
+        self.requests_served = 0
+
+    def respond(self, request):
+        event = request['Event']
+        match event['action']:
+            case 'recommend':
+                return {"result": {
+                    "recommended_memory": self.mem_list[0],
+                    "action_probability": 1 / len(self.mem_list),
+                    "probability_list": [1 / len(self.mem_list)] * len(self.mem_list),
+                }}
+            case 'observe':
+                return {"result": 1}
+            case 'observe_batch':
+                return {"result": len(event['Requests'])}
+            case 'flush':
+                return {"result": 0}
+
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                headers = dict(line.split(':', 1) for line in head.decode('latin-1').split('\r\n')[1:] if ':' in line)
+                headers = {name.strip().lower(): value.strip() for name, value in headers.items()}
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                await asyncio.sleep(self.latency)
+                payload = json.dumps({"statusCode": 200, "body": self.respond(json.loads(body))}).encode()
+                self.requests_served += 1
+
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                             + f'Content-Length: {len(payload)}\r\n\r\n'.encode() + payload)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def run(self):
+        server = await asyncio.start_server(self.serve_connection, self.host, self.port)
+        print(f"StubAgent.run - listening on http://{self.host}:{self.port}/ with {self.latency * 1000:.0f} ms latency")
+        async with server:
+            await server.serve_forever()
+
+    def start_in_thread(self):
+        thread = threading.Thread(target=asyncio.run, args=(self.run(),), daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/"
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Run a stub CMAB agent API that answers after a fixed latency.')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds before answering each request')
+
+    args = parser.parse_args()
+
+    asyncio.run(StubAgent(port=args.port, latency=args.latency).run())
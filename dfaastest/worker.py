@@ -1,30 +1,62 @@
 import argparse
+import asyncio
 import datetime
 import time
 
 from funk_updater import FunkUpdater
 from utils.config_utils import get_config, get_funk_names
-from utils.database import DB
+from utils.database import DB, record_columns
+from utils.reconfiguration_policy import ReconfigurationPolicy
+from utils.rolling_stats import payload_stats_for
+from async_cmab_client import AsyncCmabClient
 from cmab_client import CmabClient
 
 
 class DfaastestOperator(object):
 
-    def __init__(self, config, dryrun, funk_name, experiment_id):
+    def __init__(self, config, dryrun, funk_name, experiment_id, db=None, transport=None):
+        """
+        db, transport: the database and the agent's HTTP transport shared with the operators of other functions in
+        the process (see multi_operator.py), otherwise the operator opens its own
+        """
         self.config = config
         self.dryrun = dryrun
         self.funk_name = funk_name
         self.experiment_id = experiment_id
         self.num_of_records_observed = 0
 
-        self.config['cmab_agent']['model_funk'] = self.funk_name
-        self.config['cmab_agent']['model_experiment'] = self.experiment_id
-        self.cmab_client = CmabClient(self.config['cmab_agent'])
+        cmab_config = {**self.config['cmab_agent'], 'model_funk': self.funk_name, 'model_experiment': self.experiment_id}
+        # 'sync' sends the agent requests one after another, 'async' pipelines them (see run_async)
+        self.client_mode = config['operator'].get('client', 'sync')
+        match self.client_mode:
+            case 'sync':
+                self.cmab_client = CmabClient(cmab_config, transport=transport)
+            case 'async':
+                self.cmab_client = AsyncCmabClient(cmab_config)
 
         self.funk_updater = FunkUpdater(self.config['funk_generator'][funk_name])
+        # whether a recommended memory is worth a configuration update and the cold starts that follow
+        self.reconfiguration = ReconfigurationPolicy(config['operator'].get('reconfigure'))
 
         self.wait_period = config['operator']['wait_period']
         self.recommend_payload_algorithm = config['operator']['recommend_payload_algorithm']
+        # rolling window of the payload sizes of the processed records, seeded from the DB on first use
+        self.payload_stats = payload_stats_for(self.recommend_payload_algorithm, config['operator'].get('payload_ewma_alpha', 0.1))
+        self.payload_stats_seeded = False
+
+        # 'poll' checks for new records every wait_period, 'push' wakes up on the notifications of
+        # sql/notify_new_records.sql (and still polls every wait_period, in case a notification was missed)
+        self.ingest = config['operator'].get('ingest', 'poll')
+        self.push_debounce = config['operator'].get('push_debounce', 0)
+        self.notify_channel = f"new_records:{self.funk_name}"
+        # records claimed per batch, which bounds the worker's memory however large the backlog, and seconds a batch
+        # can stall before its records are released to the other workers of the function
+        self.batch_size = config['operator'].get('batch_size') or 1000
+        if not isinstance(self.batch_size, int) or self.batch_size < 1:
+            raise ValueError(f"operator.batch_size must be a positive number of records, not {self.batch_size!r}")
+        self.fetch_size = config['operator'].get('fetch_size', 1000)  # records per round trip of the DB cursor
+        self.lease_seconds = config['operator'].get('lease_seconds', 0)
+        self.latency_metrics = {'batches': 0, 'newest_total': 0.0, 'newest_max': 0.0, 'oldest_total': 0.0, 'oldest_max': 0.0}
 
         # connect to DB
         self.db_config = self.config['database']
@@ -36,25 +68,19 @@ class DfaastestOperator(object):
         DB_TABLE = self.db_config['table']
 
         try:
-            self.db = DB(host=DB_HOST, user=DB_USER, password=DB_PASS, db=DB_NAME)
+            self.db = db or DB(host=DB_HOST, user=DB_USER, password=DB_PASS, db=DB_NAME)
         except Exception as e:
             print("ERROR: Unexpected error: Could not connect to the PostgreSQL instance.")
             raise e
 
+        # to measure the latency from the records' insert (database clock) to the recommendation (local clock)
+        self.db_clock_offset = self.db.clock_offset() if not self.dryrun else datetime.timedelta(0)
+
     def get_data(self):
         print(f"DfaastestOperator get_data...")
 
         if not self.dryrun:
-            records = self.db.query(
-                sql='''
-            select *
-              from logs_processor_data
-             where status is null
-               and function_name = %s
-             order by created_date
-             ''',
-                params=(self.funk_name,)
-            )
+            records = self.db.claim_records(self.funk_name, self.batch_size, self.fetch_size)
 
         else:
             # dryrun simulated sample record
@@ -73,29 +99,34 @@ class DfaastestOperator(object):
                 )
             ]
 
-        print(f"DfaastestOperator.get_data - records: {records}")
+        if records:
+            print(f"DfaastestOperator.get_data - records: {len(records)}, from {records[0][0]} ({records[0][3]}) to {records[-1][0]} ({records[-1][3]})")
+        else:
+            print(f"DfaastestOperator.get_data - records: 0")
 
         return records
 
-    def get_last_x_records(self, limit=None):
+    def get_last_x_records(self, limit=None, seconds=None):
         print(f"DfaastestOperator get_last_x_records...")
 
         if not self.dryrun:
 
-            query = '''
-            select *
+            query = f'''
+            select {record_columns}
               from logs_processor_data
              where function_name = %s
                and status is not null
+               and (%s::float is null or created_date >= (select max(created_date)
+                                                            from logs_processor_data
+                                                           where function_name = %s
+                                                             and status is not null) - %s::float * interval '1 second')
              order by created_date desc
+             limit %s
             '''
 
-            if limit:
-                query += f'''
-                limit {limit}
-                '''
-
-            records = self.db.query(sql=query, params=(self.funk_name,))
+            # a null limit returns every record. seconds are counted back from the newest processed record, like the
+            # rolling window trims its records, not from now: after a backlog or a restart the window is the same
+            records = self.db.query(sql=query, params=(self.funk_name, seconds, self.funk_name, seconds, limit))
 
         else:
             # dryrun simulated sample record
@@ -114,7 +145,7 @@ class DfaastestOperator(object):
                 )
             ]
 
-        print(f"DfaastestOperator.get_data - records: {records}")
+        print(f"DfaastestOperator.get_last_x_records - records: {len(records)}")
 
         return records
 
@@ -123,7 +154,6 @@ class DfaastestOperator(object):
             cumulative_payload = 0
 
             for record in records:
-                print(f"get_average_payload - record: {record}")
                 payload = record[2]
                 cumulative_payload += int(payload["payload_size"])
 
@@ -131,56 +161,175 @@ class DfaastestOperator(object):
         else:
             return 1
 
+    def get_recommend_payload_size(self, records):
+        if self.payload_stats is None:
+            # wait_period: the average of the batch
+            return self.get_average_payload(records)
+
+        if not self.payload_stats_seeded:
+            # the processed history, once (it includes the batch, marked processed in the same transaction); later
+            # batches are added to the window as they are processed
+            limit, seconds = self.payload_stats.seed_window()
+            self.payload_stats.add_records(reversed(self.get_last_x_records(limit, seconds)))
+            self.payload_stats_seeded = True
+        else:
+            self.payload_stats.add_records(records)
+
+        payload_size = self.payload_stats.mean()
+        return payload_size if payload_size is not None else 1
+
+    def wait_for_records(self):
+        match self.ingest:
+            case 'poll':
+                time.sleep(self.wait_period)  # wait before checking again
+            case 'push':
+                notifies = self.db.wait_for_notify([self.notify_channel], self.wait_period, self.push_debounce)
+                if notifies is None:
+                    print(f"DfaastestOperator.wait_for_records - listening on {self.notify_channel}, polling for missed records")
+                elif notifies:
+                    print(f"DfaastestOperator.wait_for_records - {len(notifies)} notifications")
+
+    def record_latency(self, records):
+        """
+        time from the insert of the batch's newest and oldest records to now, when their recommendation is applied
+        """
+        now = datetime.datetime.now() - self.db_clock_offset
+        newest = (now - max(record[3] for record in records)).total_seconds()  # 3 is the created_date
+        oldest = (now - min(record[3] for record in records)).total_seconds()
+
+        metrics = self.latency_metrics
+        metrics['batches'] += 1
+        metrics['newest_total'] += newest
+        metrics['newest_max'] = max(metrics['newest_max'], newest)
+        metrics['oldest_total'] += oldest
+        metrics['oldest_max'] = max(metrics['oldest_max'], oldest)
+        print(f"insert to recommendation latency ({self.ingest}) - newest record: {newest:.2f} s "
+              f"(avg {metrics['newest_total'] / metrics['batches']:.2f} s, max {metrics['newest_max']:.2f} s), "
+              f"oldest record: {oldest:.2f} s "
+              f"(avg {metrics['oldest_total'] / metrics['batches']:.2f} s, max {metrics['oldest_max']:.2f} s)")
+
+    def apply_recommendation(self, records, payload_size, recommendation):
+        print(f"getting recommendation from cmab agent: {recommendation['recommended_memory']}")
+        skipped = self.reconfigure(records, recommendation)
+        self.log_recommendation(records, payload_size, recommendation, deployed=skipped in (None, 'noop'))
+        self.record_latency(records)
+
+    def reconfigure(self, records, recommendation):
+        """
+        update the function's memory to the recommended one, unless the reconfiguration policy skips it.
+        returns the reason it was skipped, None when it was applied
+        """
+        memory = recommendation['recommended_memory']
+        skipped = self.reconfiguration.decide(recommendation, records)
+        if skipped is None:
+            self.funk_updater.update_function_memory(memory=memory)
+            self.reconfiguration.applied(memory)
+        else:
+            print(f"DfaastestOperator.reconfigure - keeping memory {self.reconfiguration.current_memory} ({skipped}), "
+                  f"updates: {self.reconfiguration.summary()}")
+        return skipped
+
+    def log_recommendation(self, records, payload_size, recommendation, db=None, deployed=True):
+        """
+        record the recommendation in recommendation_record (on db, by default the operator's) with the probabilities of
+        the memory the function runs at. deployed: the recommended memory is the one the function runs at (applied, or
+        already its memory), its probabilities tag the next observations. Otherwise the function keeps the memory chosen
+        by an earlier recommendation, and the observations keep that recommendation's probabilities: the agent weighs
+        each observation by the probability of its memory in the distribution that chose it.
+        """
+        if deployed:
+            self.cmab_client.update_probabilities(recommendation)
+
+        self.num_of_records_observed += len(records)
+        (db or self.db).insert_recommendation_probability(
+            self.funk_name, self.experiment_id, self.cmab_client.probability_dict, self.num_of_records_observed,
+            payload_size, recommendation['recommended_memory'], records[-1][2]["memory_size"]) # memory_size of last record
+
+    def process_batch(self):
+        """
+        claim the records waiting for the function, if any, observe them and apply a new recommendation.
+        returns the number of records processed
+        """
+        # the records stay claimed by this worker until they are observed and marked processed, in one transaction. The
+        # agent can not unlearn them, so the transaction ends there: a failure of the next steps does not claim (and
+        # observe) them again
+        with self.db.transaction():
+            if self.lease_seconds:
+                self.db.lease(self.lease_seconds)
+
+            records = self.get_data()
+
+            if records:
+
+                # Step 1 Observe, the whole backlog in one round trip to the cmab agent
+                self.cmab_client.send_observe_batch(payloads=[record[2] for record in records]) # 2 is the payload
+                self.db.update_records_status([record[0] for record in records], 'P', self.experiment_id)
+                payload_size = self.get_recommend_payload_size(records)
+
+        if records:
+
+            # Step 2 Recommend
+            recommendation = self.cmab_client.send_recommend(payload={"payload_size": payload_size})
+
+            # Step 3 Apply the recommendation
+            self.apply_recommendation(records, payload_size, recommendation)
+
+        return len(records)
+
     def run(self):
         print(f"DfaastestOperator running...")
 
         # To stop we need to kill the process
         while True:
-            records = self.get_data()
+            if not self.process_batch():
+                self.wait_for_records()
 
-            if records:
+            if self.dryrun:
+                break
 
-                # Step 1 Observe
-                for record in records:
-                    print(f"record: {record}")
+    async def run_async(self):
+        """
+        same loop as run with the AsyncCmabClient: a backlog is observed as pipelined observe_batch requests, and the
+        blocking DB and Lambda configuration calls run on worker threads.
+        """
+        print(f"DfaastestOperator running (async)...")
+        await self.cmab_client.start()
 
-                    self.cmab_client.send_observe(payload=record[2]) # 2 is the payload
+        try:
+            while True:
 
-                    self.db.update_record_status(record[0], 'P', self.experiment_id)
+                # the records stay claimed by this worker until they are observed and marked processed, in one
+                # transaction, see process_batch
+                with self.db.transaction():
+                    if self.lease_seconds:
+                        await asyncio.to_thread(self.db.lease, self.lease_seconds)
 
-                # Step 2 Recommend
-                payload_size = 1
-                match self.recommend_payload_algorithm:
-                    case 'wait_period':
-                        payload_size = self.get_average_payload(records)
+                    records = await asyncio.to_thread(self.get_data)
 
-                    case 'last_10':
-                        last_10_records = self.get_last_x_records(10)
-                        payload_size = self.get_average_payload(last_10_records)
+                    if records:
 
-                    case 'last_100':
-                        last_100_records = self.get_last_x_records(100)
-                        payload_size = self.get_average_payload(last_100_records)
+                        # Step 1 Observe
+                        await self.cmab_client.observe_backlog([record[2] for record in records]) # 2 is the payload
+                        await asyncio.to_thread(self.db.update_records_status, [record[0] for record in records], 'P', self.experiment_id)
+                        payload_size = await asyncio.to_thread(self.get_recommend_payload_size, records)
 
-                recommendation = self.cmab_client.send_recommend(payload={"payload_size": payload_size})
-                print(f"getting recommendation from cmab agent: {recommendation['recommended_memory']}")
-                self.funk_updater.update_function_memory(memory=recommendation['recommended_memory'])
-                self.cmab_client.probability = recommendation['action_probability']
-                self.cmab_client.probability_dict = {self.cmab_client.mem_list[i]: recommendation['probability_list'][i] for i in range(len(self.cmab_client.mem_list))}
+                if records:
 
-                self.num_of_records_observed += len(records)
-                self.db.insert_recommendation_probability(
-                    self.funk_name, self.experiment_id, self.cmab_client.probability_dict, self.num_of_records_observed,
-                    payload_size, recommendation['recommended_memory'], records[-1][2]["memory_size"]) # memory_size of last record
+                    # Step 2 Recommend
+                    recommendation = await self.cmab_client.send_recommend(payload={"payload_size": payload_size})
 
-                if self.dryrun:
-                    break
+                    # Step 3 Apply the recommendation
+                    await asyncio.to_thread(self.apply_recommendation, records, payload_size, recommendation)
 
-            else:
-                time.sleep(self.wait_period)  # wait before checking again
+                if not records:
+                    await asyncio.to_thread(self.wait_for_records)
 
                 if self.dryrun:
                     break
+        finally:
+            # persist observations the agent may still hold in memory (write-behind checkpointing)
+            await self.cmab_client.send_flush()
+            print(f"memory updates: {self.reconfiguration.summary()}")
 
     def benchmark(self):
         print(f"DfaastestOperator benchmark - starting...")
@@ -194,10 +343,10 @@ class DfaastestOperator(object):
                 # Step 1 Observe
                 for record in records:
                     print(f"DfaastestOperator benchmark - record: {record}")
-                    self.db.update_record_status(record[0], 'B', self.experiment_id)
+                self.db.update_records_status([record[0] for record in records], 'B', self.experiment_id)
 
             else:
-                time.sleep(self.wait_period)  # wait before checking again
+                self.wait_for_records()
 
                 if self.dryrun:
                     break
@@ -225,4 +374,12 @@ if __name__ == '__main__':
                 funk_name=args.funk_name,
                 experiment_id=args.experiment_id
             )
-            operator.run()
+            if operator.client_mode == 'async':
+                asyncio.run(operator.run_async())
+            else:
+                try:
+                    operator.run()
+                finally:
+                    # persist observations the agent may still hold in memory (write-behind checkpointing)
+                    operator.cmab_client.send_flush()
+                    print(f"memory updates: {operator.reconfiguration.summary()}")
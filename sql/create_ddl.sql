@@ -1,3 +1,7 @@
+-- initial schema, recreates the table from scratch as of migration 002 (unpartitioned). Run python dfaastest/migrate.py
+-- afterwards for the partitioned table and its indexes; existing databases are upgraded with the versioned migrations
+-- of sql/migrations instead.
+
 drop table if exists public.logs_processor_data;
 
 create table if not exists public.logs_processor_data (
@@ -5,6 +9,7 @@ create table if not exists public.logs_processor_data (
     function_name VARCHAR(64),
     payload JSONB,
     created_date TIMESTAMP,
-    status VARCHAR(1)
+    status VARCHAR(1),
+    experiment_id VARCHAR(64)
 );
 
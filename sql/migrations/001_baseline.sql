@@ -0,0 +1,10 @@
+-- logs_processor_data as created by sql/create_ddl.sql: the records of the functions' invocations, polled by the
+-- workers while their status is null. Unqualified names, the migrations apply to the schema of the search_path.
+
+create table if not exists logs_processor_data (
+    request_id VARCHAR(36),
+    function_name VARCHAR(64),
+    payload JSONB,
+    created_date TIMESTAMP,
+    status VARCHAR(1)
+);
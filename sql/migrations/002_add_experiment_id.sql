@@ -0,0 +1,3 @@
+-- the experiment that processed the record, written by the workers with the status
+
+alter table logs_processor_data add column if not exists experiment_id VARCHAR(64);
@@ -0,0 +1,56 @@
+-- logs_processor_data becomes range partitioned by month of created_date, so that the polls and the history queries
+-- of recent records only touch the recent partitions, and old experiments can be detached or dropped as a whole.
+-- request_id is the primary key within the created_date of the record: the key of a partitioned table has to include
+-- the partition key.
+
+create or replace function create_logs_processor_data_partitions(start_date TIMESTAMP, end_date TIMESTAMP)
+returns void as $$
+declare
+    partition_start TIMESTAMP := date_trunc('month', start_date);
+begin
+    while partition_start < end_date loop
+        execute format(
+            'create table if not exists %I partition of logs_processor_data for values from (%L) to (%L)',
+            'logs_processor_data_' || to_char(partition_start, 'YYYY_MM'), partition_start, partition_start + interval '1 month');
+        partition_start := partition_start + interval '1 month';
+    end loop;
+end;
+$$ language plpgsql;
+
+alter table logs_processor_data rename to logs_processor_data_unpartitioned;
+
+create table logs_processor_data (
+    request_id VARCHAR(36) not null,
+    function_name VARCHAR(64),
+    payload JSONB,
+    created_date TIMESTAMP not null,
+    status VARCHAR(1),
+    experiment_id VARCHAR(64),
+    primary key (request_id, created_date)
+) partition by range (created_date);
+
+-- records outside of the monthly partitions, e.g. when the next months' partitions were not created in time
+create table logs_processor_data_default partition of logs_processor_data default;
+
+select create_logs_processor_data_partitions(
+    least((select min(created_date) from logs_processor_data_unpartitioned), localtimestamp),
+    localtimestamp + interval '3 months');
+
+insert into logs_processor_data (request_id, function_name, payload, created_date, status, experiment_id)
+select request_id, function_name, payload, coalesce(created_date, 'epoch'), status, experiment_id
+  from logs_processor_data_unpartitioned
+ where request_id is not null
+on conflict do nothing;
+
+drop table logs_processor_data_unpartitioned;
+
+-- the push ingestion trigger (sql/notify_new_records.sql) was dropped with the old table
+do $$
+begin
+    if exists (select 1 from pg_proc where proname = 'notify_new_records') then
+        create trigger logs_processor_data_notify
+            after insert on logs_processor_data
+            for each row execute function notify_new_records();
+    end if;
+end;
+$$;
@@ -0,0 +1,6 @@
+-- the workers' poll: where status is null and function_name = %s order by created_date. Only the unprocessed records
+-- are indexed, so the index stays small however many processed records accumulate, and answers the poll in order.
+
+create index if not exists logs_processor_data_unprocessed_idx
+    on logs_processor_data (function_name, created_date)
+    where status is null;
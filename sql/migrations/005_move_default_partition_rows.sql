@@ -0,0 +1,42 @@
+-- creating the monthly partition of records that landed in the default partition (its month was not created in time)
+-- fails: the default partition holds rows of the new partition's range. The default partition is detached, the new
+-- partition created, the month's rows moved from the default partition into it, and the default partition attached
+-- again, all within the transaction of the function's caller.
+
+create or replace function create_logs_processor_data_partitions(start_date TIMESTAMP, end_date TIMESTAMP)
+returns void as $$
+declare
+    partition_start TIMESTAMP := date_trunc('month', start_date);
+    partition_name TEXT;
+    has_default BOOLEAN := to_regclass('logs_processor_data_default') is not null;
+begin
+    while partition_start < end_date loop
+        partition_name := 'logs_processor_data_' || to_char(partition_start, 'YYYY_MM');
+
+        if to_regclass(partition_name) is null then
+            if has_default then
+                alter table logs_processor_data detach partition logs_processor_data_default;
+            end if;
+
+            execute format(
+                'create table %I partition of logs_processor_data for values from (%L) to (%L)',
+                partition_name, partition_start, partition_start + interval '1 month');
+
+            if has_default then
+                execute format(
+                    'with moved as (delete from logs_processor_data_default where created_date >= %L and created_date < %L returning *) '
+                    'insert into logs_processor_data select * from moved',
+                    partition_start, partition_start + interval '1 month');
+                alter table logs_processor_data attach partition logs_processor_data_default default;
+            end if;
+        end if;
+
+        partition_start := partition_start + interval '1 month';
+    end loop;
+end;
+$$ language plpgsql;
+
+-- the months whose records already landed in the default partition
+select create_logs_processor_data_partitions(min(created_date), max(created_date) + interval '1 microsecond')
+  from logs_processor_data_default
+having count(*) > 0;
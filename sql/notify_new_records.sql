@@ -0,0 +1,16 @@
+-- push ingestion (operator.ingest: 'push' in dfaastest/config.yaml): inserts into logs_processor_data notify the
+-- workers of their function on the channel "new_records:<function_name>". Identical notifications of a transaction
+-- are delivered once, so a transaction inserting many records of a function wakes its worker once.
+
+create or replace function public.notify_new_records() returns trigger as $$
+begin
+    perform pg_notify('new_records:' || new.function_name, '');
+    return new;
+end;
+$$ language plpgsql;
+
+drop trigger if exists logs_processor_data_notify on public.logs_processor_data;
+
+create trigger logs_processor_data_notify
+    after insert on public.logs_processor_data
+    for each row execute function public.notify_new_records();